@@ -1,19 +1,22 @@
 from solver_single_ode import SolverOde
+from mm_solver_exp import SolverExp
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as grd
 import seaborn as sns
 import pandas as pd
 import logging as log
-
+from mm_result_cache import SOLVER_SETTINGS, cached_tables
 
 class AnalyzerODE:
 
-    def __init__(self, kinetic, t0, te):
+    def __init__(self, kinetic, t0, te, solver='ode', cache=None):
         """
         :param kinetic: ModelBuilder object
         :param t0: simulation start time
         :param te: simulation end time
+        :param solver: 'ode' (numeric integration) or 'exp' (exact propagator, piecewise constant stimuli only)
+        :param cache: ResultCache object, results are integrated every time if not given
         :return:
         """
         self.kinetic = kinetic
@@ -22,12 +25,14 @@ class AnalyzerODE:
 
         self.stimuli = kinetic.stimuli
         self.t0, self.te = t0, te
-
-        # integration results
-        self.results_dynamic = self.integrate_model()
-
-        # parsed results
-        self.tp_bystate, self.tp_bycategory = self.trajectories()
+        self.solver = solver
+        self.settings = SOLVER_SETTINGS['analyzer_single_ode'][solver]
+
+        idx = self.modeli_stimuli_idx
+        self.results_dynamic = None
+        tables = cached_tables(cache, 'analyzer_single_ode', solver, self.model[idx:idx + 1], kinetic.states_ini_concentrations,
+                               kinetic.agonist_concentrations[idx:idx + 1], t0, te, kinetic.states_belongs, self.compute_tables)
+        self.tp_bystate, self.tp_bycategory = tables['tp_bystate'], tables['tp_bycategory']
         self.ta_stimuli = self.trajectories_stimuli()
 
         # global plot settings
@@ -36,13 +41,24 @@ class AnalyzerODE:
         sns.set_palette('Paired', kinetic.states_number)
         self.colors = sns.color_palette('Paired', kinetic.states_number)
 
+    def compute_tables(self):
+        """
+        integrates model and parses results
+        :return: dictionary (table name: data frame)
+        """
+        self.results_dynamic = self.integrate_model()
+        tp_bystate, tp_bycategory = self.trajectories()
+        return {'tp_bystate': tp_bystate, 'tp_bycategory': tp_bycategory}
+
     def integrate_model(self):
         """
         runs ode solver for all models
         :return:
         """
         log.info('### Integration begins ###')
-        return SolverOde(self.model[self.modeli_stimuli_idx].trmn, self.kinetic.states_ini_concentrations, self.kinetic.states_names, self.t0, self.te)
+        if self.solver == 'exp':
+            return SolverExp(self.model[self.modeli_stimuli_idx], self.kinetic.states_ini_concentrations, self.kinetic.states_names, self.t0, self.te, **self.settings)
+        return SolverOde(self.model[self.modeli_stimuli_idx].trmn, self.kinetic.states_ini_concentrations, self.kinetic.states_names, self.t0, self.te, **self.settings)
 
     def trajectories(self):
         """
@@ -62,7 +78,7 @@ class AnalyzerODE:
         ta_stimuli = []
         for stimulus in self.stimuli:
             time = np.linspace(self.t0 - 2, self.te, int(1e5))
-            df = pd.DataFrame({'time': time, 'stimuli': [stimulus(ti) for ti in time]})
+            df = pd.DataFrame({'time': time, 'stimuli': stimulus(time)})
             ta_stimuli.append(df.set_index('time', drop=True))
 
         return ta_stimuli
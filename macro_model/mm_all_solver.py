@@ -8,6 +8,7 @@ import logging as log
 from mm_solver_glp import SolverGlp
 from mm_kinetic_models import ModelBuilder
 from analyzer_single_ode import AnalyzerODE
+from mm_result_cache import ResultCache
 
 log.basicConfig(filename='mm_kin.log', filemode='w', format='%(message)s', level=log.DEBUG)
 log.info("### Kinetic solver starts!")
@@ -19,6 +20,7 @@ build_models = ModelBuilder('spont18', [0.003], 'single')
 t0 = 0
 te = 3000
 part = 10
+solver = 'exp'      # 'ode' or 'exp' (exact for piecewise constant stimuli)
 
 # solving!
 solve_ode = True
@@ -28,18 +30,18 @@ steady = True
 solve_glp = False
 
 if solve_ode:
-    ode_analysis = AnalyzerODE(build_models, t0, te)
+    ode_analysis = AnalyzerODE(build_models, t0, te, solver, ResultCache())
     if dynamic:
         ode_analysis.plot_dynamic_response()
     #if steady:
     #    ode_analysis.plot_steady_dose_response()
 
 if solve_glp:
-    solver = SolverGlp(model_kinetic, ini_conc, part, t0, te, suspend, opsh)
+    solver = SolverGlp(model_kinetic, ini_conc, part, t0, te, opsh)
 
     allT, allP, mcT, mcP, distT, opshDistT = solver.get_results()
 
-    P = allP[0]
+    P = np.eye(len(states_na))[allP[0]]                 # state indexes to one-hot rows
     T = allT[0]
     Pn = np.array([[float('nan') if state == 0.0 else state for state in step] for step in P])
     T = np.array([T]).transpose()
@@ -2,9 +2,9 @@ import logging as log
 import numpy as np
 
 from dcpyps import dcio
-from dcpyps import dataset
 from dcpyps import mechanism
 from dcpyps import fitMLL
+from mm_scn_cache import scn_record
 
 
 class KineticDc:
@@ -47,8 +47,7 @@ class KineticDc:
         self.bursts = []
 
         for sfs, cn, tr, tc in zip(self.scn_files, self.scn_conc, self.scn_tres, self.scn_tcrit):
-            rec = dataset.SCRecord(sfs, cn, tr, tc)
-            rec.record_type = 'recorded'
+            rec = scn_record(sfs, cn, tr, tc)
             self.recs.append(rec)
             self.bursts.append(rec.bursts.intervals())
             log.info(rec)
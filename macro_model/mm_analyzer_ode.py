@@ -1,4 +1,8 @@
 from mm_solver_ode import SolverOde
+from mm_solver_exp import SolverExp
+from mm_solver_batch import SolverBatch
+from mm_solver_steady import SolverSteady
+from mm_solver_ivp import SolverIvp
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as grd
@@ -6,21 +10,27 @@ import matplotlib.colors as cls
 import seaborn as sns
 import pandas as pd
 import logging as log
-
+from mm_result_cache import SOLVER_SETTINGS, cached_tables
 
 class AnalyzerODE:
 
-    def __init__(self, models, t0, te):
+    def __init__(self, models, t0, te, solver='ode', cache=None):
         """
         :param models: ModelBuilder object
         :param t0: simulation start time
         :param te: simulation end time
+        :param solver: 'ode' (numeric integration), 'ivp' (stiff integration restarted at stimulus edges),
+                       'exp' (exact propagator) or 'batch' (all concentrations propagated together),
+                       'exp' and 'batch' for piecewise constant stimuli only
+        :param cache: ResultCache object, results are integrated every time if not given
         :return:
         """
         self.models = models.models
         self.agonist_concentrations = models.agonist_concentrations
         self.stimuli = models.stimuli
         self.t0, self.te = t0, te
+        self.solver = solver
+        self.settings = SOLVER_SETTINGS['mm_analyzer_ode'][solver]
 
         # model parameters
         self.states = models.states
@@ -30,16 +40,12 @@ class AnalyzerODE:
         self.states_number = models.states_number
         self.states_ini_concentrations = models.states_ini_concentrations
 
-        # integration results
-        log.info('### Integration begins')
-        self.results_dynamic = self.integrate_model(False)
-        self.results_steady = self.integrate_model(True)
-
-        # parsed results
-        log.info('### Integration results parsing begins')
-        self.tp_bystate, self.tp_bycategory = self.trajectories()
+        tables = cached_tables(cache, 'mm_analyzer_ode', solver, self.models, self.states_ini_concentrations,
+                               self.agonist_concentrations, t0, te, self.states_belongs, self.compute_tables)
+        self.tp_bystate, self.tp_bycategory = tables['tp_bystate'], tables['tp_bycategory']
+        self.results_dynamic, self.results_steady = self.tp_bystate, tables['results_steady']
+        self.steady_bystate, self.steady_bycategory = tables['steady_bystate'], tables['steady_bycategory']
         self.ta_stimuli = self.trajectories_stimuli()
-        self.steady_bystate, self.steady_bycategory = self.steady_occupancies()
 
         # global plot settings
         sns.set_style("ticks", {'legend.frameon': True})
@@ -80,14 +86,41 @@ class AnalyzerODE:
 
             return data
 
+    def compute_tables(self):
+        """
+        integrates models and parses results
+        :return: dictionary (table name: data frame or list of data frames)
+        """
+        # integration results
+        log.info('### Integration begins')
+        self.results_dynamic = self.integrate_model(False)
+        self.results_steady = SolverSteady(self.models, self.states_ini_concentrations, self.states_names, self.agonist_concentrations).get_results()
+
+        # parsed results
+        log.info('### Integration results parsing begins')
+        tp_bystate, tp_bycategory = self.trajectories()
+        steady_bystate, steady_bycategory = self.steady_occupancies()
+        return {'tp_bystate': tp_bystate, 'tp_bycategory': tp_bycategory, 'results_steady': self.results_steady,
+                'steady_bystate': steady_bystate, 'steady_bycategory': steady_bycategory}
+
     def integrate_model(self, equi):
         """
         runs ode solver for all models
         :param equi:
-        :return:
+        :return: list (concentrations) of dataframes (time + states)
         """
 
-        return [SolverOde(model.trmn, self.states_ini_concentrations, self.states_names, self.t0, self.te, equi) for model in self.models]
+        if self.solver == 'batch':
+            batch = SolverBatch(self.models, self.states_ini_concentrations, self.states_names, self.t0, self.te, self.agonist_concentrations, **self.settings)
+            return [batch.get_system(idx) for idx in range(len(self.models))]
+
+        if self.solver == 'ivp':
+            return [SolverIvp(model, self.states_ini_concentrations, self.states_names, self.t0, self.te, **self.settings).get_results() for model in self.models]
+
+        if self.solver == 'exp':
+            return [SolverExp(model, self.states_ini_concentrations, self.states_names, self.t0, self.te, **self.settings).get_results() for model in self.models]
+
+        return [SolverOde(model.trmn, self.states_ini_concentrations, self.states_names, self.t0, self.te, equi, **self.settings).get_results() for model in self.models]
 
     def trajectories(self):
         """
@@ -97,7 +130,7 @@ class AnalyzerODE:
         log.info('Parsing trajectories')
         tp_bystate, tp_bycategory = [], []
         for idx, result in enumerate(self.results_dynamic):
-            tp_bystate.append(result.get_results())
+            tp_bystate.append(result)
             tp_bycategory.append(pd.DataFrame({category: tp_bystate[idx][self.states_belongs[category]].sum(axis=1) for category in self.states_belongs}))
         return [tp_bystate, tp_bycategory]
 
@@ -110,22 +143,20 @@ class AnalyzerODE:
         ta_stimuli = []
         for stimulus in self.stimuli:
             time = np.linspace(self.t0 - 2, self.te, int(1e5))
-            df = pd.DataFrame({'time': time, 'stimuli': [stimulus(ti) for ti in time]})
+            df = pd.DataFrame({'time': time, 'stimuli': stimulus(time)})
             ta_stimuli.append(df.set_index('time', drop=True))
 
         return ta_stimuli
 
     def steady_occupancies(self):
         """
-        parse steady state occupancies
+        parse steady state occupancies (equilibrium under continuous agonist application)
         :return: list (concentrations) of dataframes (concentration + state/category)
         """
         log.info('Parsing steady state occupancies')
         steady_bystate, steady_bycategory = [], []
-        for concentration, result in zip(self.agonist_concentrations, self.results_steady):
-            steady = result.get_results().iloc[-1:]
-            steady.index = [concentration]              # explicit to avoid nan substitution
-            steady.index.name = 'concentration'
+        for idx in range(len(self.agonist_concentrations)):
+            steady = self.results_steady.iloc[idx:idx + 1]
             steady_bystate.append(steady)
             steady_bycategory.append(pd.DataFrame({category: steady.loc[:, self.states_belongs[category]].sum(axis=1) for category in self.states_belongs}))
 
@@ -0,0 +1,174 @@
+import os
+import json
+import time as tm
+import platform
+import argparse
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+import scipy
+from mm_kinetic_models import ModelBuilder
+from mm_kinetic_models import compile_model
+from mm_solver_ode import SolverOde
+from mm_solver_exp import SolverExp
+from mm_solver_ivp import SolverIvp
+from mm_solver_batch import SolverBatch
+from mm_solver_steady import SolverSteady
+from mm_solver_glp import SolverGlp
+
+# benchmark suite: every case runs on fixed protocols and seeds, best wall time of repeats and peak traced memory
+# are reported and appended to history (one JSON record per run), ratios against baseline run are shown if recorded
+
+MODELS = ['jwm', 'fjwm', 'sfjwm', 'kisiel', 'spont18']
+OPEN = {'jwm': True}                                                        # open category, 'open' if not listed
+DOSES = list(np.logspace(-3, 3, 13))
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'mm_benchmark.jsonl')
+T0, TE = 0, 3000
+
+
+def case_compile(name):
+    compile_model.cache_clear()
+    compile_model(name)
+
+
+def case_ode(name, stimulus):
+    models = ModelBuilder(name, [10.0], stimulus)
+    SolverOde(models.models[0].trmn, models.states_ini_concentrations, models.states_names, T0, TE, False)
+
+
+def case_exp(name, stimulus):
+    models = ModelBuilder(name, [10.0], stimulus)
+    SolverExp(models.models[0], models.states_ini_concentrations, models.states_names, T0, TE)
+
+
+def case_ivp(name, stimulus):
+    models = ModelBuilder(name, [10.0], stimulus)
+    SolverIvp(models.models[0], models.states_ini_concentrations, models.states_names, T0, TE, method='Radau')
+
+
+def case_batch(name):
+    models = ModelBuilder(name, DOSES, 'single')
+    SolverBatch(models.models, models.states_ini_concentrations, models.states_names, T0, TE, DOSES)
+
+
+def case_steady(name):
+    models = ModelBuilder(name, DOSES, 'single')
+    SolverSteady(models.models, models.states_ini_concentrations, models.states_names, DOSES)
+
+
+def case_glp(name):
+    models = ModelBuilder(name, [10.0], 'single')
+    model = models.models[0]
+    opened = models.states_belongs[OPEN.get(name, 'open')]
+    opsh = [[no for no, state in enumerate(models.states_names) if state in opened],
+            [no for no, state in enumerate(models.states_names) if state not in opened]]
+    p0 = np.eye(models.states_number)[[int(np.argmax(models.states_ini_concentrations))]]
+    SolverGlp(model, p0, 100, T0, TE, opsh, seed=0)
+
+
+def case_analyzer(name):
+    from mm_analyzer_ode import AnalyzerODE                                 # plotting dependencies
+    AnalyzerODE(ModelBuilder(name, DOSES, 'single'), T0, TE, 'exp')
+
+
+CASES = {
+    'compile': case_compile,
+    'ode_single': lambda name: case_ode(name, 'single'),
+    'ode_pair': lambda name: case_ode(name, 'pair'),
+    'exp_single': lambda name: case_exp(name, 'single'),
+    'exp_pair': lambda name: case_exp(name, 'pair'),
+    'ivp_pair': lambda name: case_ivp(name, 'pair'),
+    'batch_dose': case_batch,
+    'steady_dose': case_steady,
+    'glp_single': case_glp,
+    'analyzer_dose': case_analyzer,
+}
+
+
+def measure(function, name, repeat):
+    """
+    :param function: benchmark case
+    :param name: mechanism name
+    :param repeat: number of timed runs
+    :return: best wall time [s], peak traced memory [bytes] (separate run, tracing slows down pure python code)
+    """
+    times = []
+    for _ in range(repeat):
+        np.random.seed(0)
+        start = tm.perf_counter()
+        function(name)
+        times.append(tm.perf_counter() - start)
+
+    np.random.seed(0)
+    tracemalloc.start()
+    try:
+        function(name)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def revision():
+    """
+    :return: current git commit, None outside repository
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def baseline(history, label):
+    """
+    :param history: history file name
+    :param label: run label, last recorded run if not given
+    :return: baseline record, None if not found
+    """
+    if not os.path.exists(history):
+        return None
+    with open(history) as records:
+        runs = [json.loads(line) for line in records if line.strip()]
+    runs = [run for run in runs if label is None or run['label'] == label]
+    return runs[-1] if runs else None
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--models', nargs='+', default=MODELS)
+parser.add_argument('--cases', nargs='+', default=list(CASES))
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--label')
+parser.add_argument('--baseline', help='label of baseline run, last recorded run if not given')
+parser.add_argument('--history', default=HISTORY)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    reference = baseline(args.history, args.baseline)
+
+    results = []
+    for case in args.cases:
+        for name in args.models:
+            try:
+                elapsed, peak = measure(CASES[case], name, args.repeat)
+            except ImportError as error:
+                print('[SKIP] {} {}: {}'.format(case, name, error))
+                continue
+            results.append({'case': case, 'model': name, 'time': elapsed, 'peak': peak})
+
+    record = {'label': args.label, 'date': tm.strftime('%Y-%m-%d %H:%M:%S'), 'revision': revision(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+              'repeat': args.repeat, 'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, 'a') as history:
+        history.write(json.dumps(record) + '\n')
+
+    table = pd.DataFrame(results).set_index(['case', 'model'])
+    if reference:
+        before = pd.DataFrame(reference['results']).set_index(['case', 'model'])
+        table['time_ratio'] = table['time'] / before['time'].reindex(table.index)
+        table['peak_ratio'] = table['peak'] / before['peak'].reindex(table.index)
+        print('Baseline: {} {} {}'.format(reference['label'], reference['date'], reference['revision']))
+    pd.set_option('display.width', 200)
+    print(table)
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import scipy.optimize as opt
+import concurrent.futures as cf
+import time as tm
+import logging as log
+from mm_kinetic_models import compile_model
+from mm_sensitivity import SolverSensitivity
+
+
+class FitterMacro:
+
+    def __init__(self, model, traces, rates, bounds=None, starts=8, seed=None, workers=1, open_category='open',
+                 iterations=500):
+        """
+        fits registered mechanism to macroscopic currents, current is modelled as common amplitude times open
+        occupancy, amplitude is solved in closed form, rates are optimized in natural log space (L-BFGS-B within
+        bounds) with analytic gradients from SolverSensitivity, multiple starts run in worker processes
+        :param model: registered mechanism name (see mm_kinetic_models.MODELS)
+        :param traces: list of (time [ms], current, stimulus) tuples, uniformly sampled, model starts from initial
+                       occupancies one sampling interval before first point
+        :param rates: list of fitted rate names, multiples of fitted rate ('2kon' for 'kon') follow it
+        :param bounds: dictionary (rate name: (low, high)), three decades around model values if not given
+        :param starts: number of starts, first one from model values, others log-uniform within bounds
+        :param seed: random seed of starting points
+        :param workers: number of worker processes
+        :param open_category: category of open states
+        :param iterations: maximum number of iterations per start
+        """
+        self.model, self.traces, self.rates, self.starts, self.seed = model, traces, list(rates), starts, seed
+        self.workers, self.open_category, self.iterations = workers, open_category, iterations
+
+        template = compile_model(self.model)
+        self.initial = np.array([macro_value(template, name) for name in self.rates])
+        bounds = {} if bounds is None else bounds
+        self.bounds = np.log([bounds.get(name, (value * 1e-3, value * 1e3)) for name, value in zip(self.rates, self.initial)])
+
+        self.results = self.fit()
+        self.best = dict(zip(self.rates, self.results.loc[0, self.rates]))
+
+    def get_starts(self):
+        """
+        :return: array of starting points (starts x rates), natural log of rates
+        """
+        rng = np.random.default_rng(self.seed)
+        x0 = rng.uniform(self.bounds[:, 0], self.bounds[:, 1], size=(self.starts, len(self.rates)))
+        x0[0] = np.clip(np.log(self.initial), self.bounds[:, 0], self.bounds[:, 1])
+        return x0
+
+    def fit(self):
+        """
+        runs all starts, in worker processes if more than one worker
+        :return: pandas data frame (start + loss, amplitude, iterations, success and fitted rates), best first
+        """
+        x0 = self.get_starts()
+        arguments = [(self.model, self.traces, self.rates, self.bounds, x, self.open_category, self.iterations) for x in x0]
+
+        log.info("### Initiating macroscopic current fit")
+        log.info("Traces: {} Rates: {} Starts: {}".format(len(self.traces), self.rates, self.starts))
+        start_time = tm.time()
+        if self.workers > 1:
+            with cf.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                fits = list(pool.map(macro_fit, *zip(*arguments)))
+        else:
+            fits = [macro_fit(*argument) for argument in arguments]
+        log.info("--- %s seconds ---" % (tm.time() - start_time))
+        log.info("### Done macroscopic current fit")
+
+        results = pd.DataFrame(fits)
+        results.insert(0, 'start', np.arange(len(fits)))
+        return results.sort_values('loss').reset_index(drop=True)
+
+    def get_results(self):
+        """
+        brings fit results
+        :return: pandas data frame (start + loss, amplitude, iterations, success and fitted rates), best first
+        """
+        return self.results
+
+    @staticmethod
+    def read_trace(filename, sweep, stimulus):
+        """
+        reads sweep of abf2csv output (time in seconds)
+        :param filename: csv file name
+        :param sweep: sweep number
+        :param stimulus: Stimulus object of sweep protocol
+        :return: time [ms], current, stimulus
+        """
+        data = pd.read_csv(filename)
+        return data['Time'].values * 1e3, data['Trace {}'.format(sweep)].values, stimulus
+
+
+def macro_value(model, name):
+    """
+    :param model: Kinetic object
+    :param name: rate name
+    :return: rate value
+    """
+    names_stimulus = model.trm_n[model.trm_rows, model.trm_cols]
+    if np.any(names_stimulus == name):
+        return model.trm_values[names_stimulus == name][0]
+    if np.any(model.trm_n == name):
+        return model.trm_c[model.trm_n == name][0]
+    raise KeyError("Unknown rate: {}".format(name))
+
+
+def macro_objective(x, template, traces, rates, open_category):
+    """
+    least squares loss of all traces (mean over points) with amplitude solved in closed form and its gradient
+    :param x: natural log of fitted rates
+    :param template: Kinetic object of registered mechanism
+    :param traces: list of (time, current, stimulus) tuples
+    :param rates: fitted rate names
+    :param open_category: category of open states
+    :return: loss, gradient with respect to x, amplitude
+    """
+    multiples = [template.trm_multiples(name) for name in rates]
+    override = {multiple: factor * value for tied, value in zip(multiples, np.exp(x)) for multiple, factor in tied.items()}
+    names = list(override)
+    opened = [template.states_names.index(name) for name in template.states_belongs[open_category]]
+
+    responses, derivatives, currents = [], [], []
+    for t, current, stimulus in traces:
+        model = template.with_stimulus(stimulus)
+        model.trm_c, model.trm_values = model.trm_override(override)
+        dt = t[1] - t[0]
+        tp, sensitivities = SolverSensitivity(model, model.states_ini_concentrations, model.states_names,
+                                              t[0] - dt, t[-1], rates=names, samples=len(t)).get_results()
+        po = sensitivities[:, opened, :].sum(axis=1)
+        responses.append(tp.values[:, opened].sum(axis=1))
+        derivatives.append(np.stack([sum(factor * po[:, names.index(multiple)] for multiple, factor in tied.items())
+                                     for tied in multiples], axis=1))
+        currents.append(current)
+
+    response, derivative, current = np.concatenate(responses), np.concatenate(derivatives), np.concatenate(currents)
+    amplitude = np.dot(response, current) / np.dot(response, response)
+    residual = amplitude * response - current
+    loss = 0.5 * np.mean(residual ** 2)
+    gradient = amplitude * np.dot(residual, derivative) / len(residual) * np.exp(x)
+    return loss, gradient, amplitude
+
+
+def macro_fit(model, traces, rates, bounds, x0, open_category, iterations):
+    """
+    runs single start (process pool worker)
+    :param model: registered mechanism name
+    :param bounds: array of natural log bounds (rates x 2)
+    :param x0: starting point, natural log of rates
+    :return: dictionary of loss, amplitude, iterations, success and fitted rates
+    """
+    template = compile_model(model)
+    result = opt.minimize(lambda x: macro_objective(x, template, traces, rates, open_category)[:2], x0, jac=True,
+                          method='L-BFGS-B', bounds=bounds, options={'maxiter': iterations})
+    loss, _, amplitude = macro_objective(result.x, template, traces, rates, open_category)
+    log.info("Start done: loss {} iterations {} {}".format(loss, result.nit, result.message))
+
+    fit = {'loss': loss, 'amplitude': amplitude, 'iterations': result.nit, 'success': result.success}
+    fit.update(zip(rates, np.exp(result.x)))
+    return fit
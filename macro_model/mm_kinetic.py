@@ -1,17 +1,23 @@
 import numpy as np
+import scipy.sparse as sps
 import logging as log
 import collections
+import copy
+import re
 
 
 class Kinetic:
     """
     kinetic Q-matrix based model
     """
-    def __init__(self, states):
+    def __init__(self, states, sparse=False):
         """
         :param states: vector of model states
+        :param sparse: keep transition rate matrix in scipy.sparse storage (large mechanisms), memory and
+                       time scale with number of transitions instead of squared number of states
         """
         self.states = states
+        self.sparse = sparse
 
         self.states_ini_concentrations = [state.border for state in self.states]
         self.states_names = [state.name for state in self.states]
@@ -32,13 +38,22 @@ class Kinetic:
             """
             :param no: state number (0 start convention)
             :param name: state name
-            :param rates: vector of transition rates to other states
+            :param rates: vector of transition rates to other states, or dictionary (state number: rate)
+                          listing existing transitions only
             :param border: initial probability of the state
             :param category: state category
             """
             self.no, self.name, self.rates, self.border, self.category, = no, name, rates, border, category
             log.info("Name: {} Rates: {} Initial: {} Open: {}".format(
-                self.name, [rate.name for rate in self.rates], self.border, self.category))
+                self.name, [rate.name for _, rate in self.transitions()], self.border, self.category))
+
+        def transitions(self):
+            """
+            :return: list of (state number, rate) pairs
+            """
+            if isinstance(self.rates, dict):
+                return list(self.rates.items())
+            return list(enumerate(self.rates))
 
         class Rate:
             def __init__(self, name, value, stimulus=False):
@@ -48,39 +63,278 @@ class Kinetic:
                 :param stimulus: stimulus if rate is time dependant
                 """
                 self.name, self.value, self.stimulus = name, value, stimulus
-                log.info("Name: {} Value: {} Stimulus: {}".format(self.name, self.value, self.stimulus.__name__ if self.stimulus else "no"))
+                log.info("Name: {} Value: {} Stimulus: {}".format(self.name, self.value, self.stimulus if self.stimulus else "no"))
+
+    def trm_compile(self):
+        """
+        compiles rate objects into arrays, stimulus dependant rates are kept apart as an index table
+        :return: constant rate matrix, rows, columns, values and stimulus indexes of stimulus dependant rates, stimuli,
+                 rate name matrix
+        """
+        stimuli = []
+        trm_c = np.zeros((self.states_number, self.states_number))
+        trm_n = np.full((self.states_number, self.states_number), '', dtype=object)
+        rows, cols, values, index = [], [], [], []
+
+        for row, state in enumerate(self.states):
+            for col, rate in state.transitions():
+                trm_n[row, col] = rate.name
+                if rate.stimulus:
+                    if rate.stimulus not in stimuli:
+                        stimuli.append(rate.stimulus)
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(rate.value)
+                    index.append(stimuli.index(rate.stimulus))
+                else:
+                    trm_c[row, col] = rate.value
+
+        return trm_c, np.array(rows, dtype=int), np.array(cols, dtype=int), \
+            np.array(values, dtype=float), np.array(index, dtype=int), stimuli, trm_n
+
+    def trm_compile_sparse(self):
+        """
+        compiles rate objects into sparse arrays, diagonal entries are skipped (filled by normalization)
+        :return: constant rate matrix (scipy.sparse COO), rows, columns, values and stimulus indexes of stimulus
+                 dependant rates, stimuli, rate names (constant rates in COO order, stimulus dependant rates)
+        """
+        stimuli = []
+        rows_c, cols_c, values_c, names_c = [], [], [], []
+        rows, cols, values, index, names = [], [], [], [], []
+
+        for row, state in enumerate(self.states):
+            for col, rate in state.transitions():
+                if row == col:
+                    continue
+                if rate.stimulus:
+                    if rate.stimulus not in stimuli:
+                        stimuli.append(rate.stimulus)
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(rate.value)
+                    index.append(stimuli.index(rate.stimulus))
+                    names.append(rate.name)
+                else:
+                    rows_c.append(row)
+                    cols_c.append(col)
+                    values_c.append(rate.value)
+                    names_c.append(rate.name)
+
+        trm_c = sps.coo_matrix((np.array(values_c, dtype=float), (np.array(rows_c, dtype=int), np.array(cols_c, dtype=int))),
+                               shape=(self.states_number, self.states_number))
+        trm_n = (np.array(names_c, dtype=object), np.array(names, dtype=object))
+
+        return trm_c, np.array(rows, dtype=int), np.array(cols, dtype=int), \
+            np.array(values, dtype=float), np.array(index, dtype=int), stimuli, trm_n
+
+    def trm_levels(self, t):
+        """
+        evaluates every distinct stimulus once
+        :param t: time
+        :return: vector of stimulus values
+        """
+        return np.array([stimulus(t) for stimulus in self.trm_stimuli], dtype=float)
+
+    def trm_override(self, rates):
+        """
+        replaces selected rate values, compiled model is left untouched
+        :param rates: dictionary (rate name: value)
+        :return: constant rate matrix, values of stimulus dependant rates
+        """
+        trm_c, trm_values = self.trm_c.copy(), self.trm_values.copy()
+        if self.sparse:
+            names_c, names_stimulus = self.trm_n
+            for name, value in rates.items():
+                if not (np.any(names_c == name) or np.any(names_stimulus == name)):
+                    raise KeyError("Unknown rate: {}".format(name))
+                trm_c.data[names_c == name] = value
+                trm_values[names_stimulus == name] = value
+            return trm_c, trm_values
+
+        names_stimulus = self.trm_n[self.trm_rows, self.trm_cols]
+        mask_stimulus = np.zeros(trm_c.shape, dtype=bool)
+        mask_stimulus[self.trm_rows, self.trm_cols] = True
+
+        for name, value in rates.items():
+            if not np.any(self.trm_n == name):
+                raise KeyError("Unknown rate: {}".format(name))
+            trm_c[(self.trm_n == name) & ~mask_stimulus] = value
+            trm_values[names_stimulus == name] = value
+
+        return trm_c, trm_values
+
+    def trm_evaluate(self, levels, normalize=True, trm_c=None, trm_values=None):
+        """
+        transition rate matrix for given stimulus values
+        :param levels: vector of stimulus values (see trm_levels)
+        :param normalize: fill diagonal with negative row sums
+        :param trm_c: constant rate matrix replacement (see trm_override)
+        :param trm_values: stimulus dependant values replacement (see trm_override)
+        :return: transition rate matrix (scipy.sparse CSR for sparse models)
+        """
+        trm_c = self.trm_c if trm_c is None else trm_c
+        trm_values = self.trm_values if trm_values is None else trm_values
+
+        if self.sparse:
+            rows = np.concatenate((trm_c.row, self.trm_rows))
+            cols = np.concatenate((trm_c.col, self.trm_cols))
+            values = np.concatenate((trm_c.data, trm_values * levels[self.trm_index]))
+            if normalize:                                                   # row normalization
+                diag = np.arange(self.states_number)
+                values = np.concatenate((values, -1 * np.bincount(rows, weights=values, minlength=self.states_number)))
+                rows, cols = np.concatenate((rows, diag)), np.concatenate((cols, diag))
+            return sps.csr_matrix((values, (rows, cols)), shape=(self.states_number, self.states_number))
+
+        trm_t = trm_c.copy()
+        trm_t[self.trm_rows, self.trm_cols] = trm_values * levels[self.trm_index]
+        if normalize:
+            trm_t[self.trm_diag] = -1 * np.sum(trm_t, axis=1)             # row normalization
+        return trm_t
+
+    def trm_constant(self):
+        """
+        checks if all stimuli are piecewise constant (required by propagator and Monte Carlo solvers)
+        :return: True or raises ValueError
+        """
+        for stimulus in self.trm_stimuli:
+            if not stimulus.constant:
+                raise ValueError("Stimulus {} is not piecewise constant".format(stimulus))
+        return True
+
+    def trm_plateau(self):
+        """
+        stimulus values during application: largest value of every stimulus, probed at its edges, in between
+        and around them (for pulse stimuli: pulse height)
+        :return: vector of stimulus values
+        """
+        levels = []
+        for stimulus in self.trm_stimuli:
+            edges = np.array([edge for edge in stimulus.edges if np.isfinite(edge)], dtype=float)
+            if not len(edges):
+                probes = np.zeros(1)
+            else:
+                probes = np.concatenate((edges, 0.5 * (edges[:-1] + edges[1:]), [edges[0] - 1., edges[-1] + 1.]))
+            levels.append(np.max(stimulus(probes)))
+        return np.array(levels, dtype=float)
+
+    def trm_edges(self, t0, te):
+        """
+        collects stimulus edge times, piecewise constant stimuli are constant in between
+        :param t0: starting time
+        :param te: ending time
+        :return: sorted list of edge times within (t0, te)
+        """
+        return sorted(set(edge for stimulus in self.trm_stimuli for edge in stimulus.edges if t0 < edge < te))
 
     def trm_create(self):
         """
         creates transition rate matrix (Q-matrix)
         :return: function returning time dependant transition rate matrix
         """
-        trm = [[rate for rate in state.rates] for state in self.states]          # rate object matrix
-        trm_r = [[rate.value for rate in row]for row in trm]                     # rate value no time matrix
+        if self.sparse:
+            self.trm_c, self.trm_rows, self.trm_cols, self.trm_values, self.trm_index, self.trm_stimuli, self.trm_n = \
+                self.trm_compile_sparse()
+            self.trm_diag = None
+
+            log.info("### Sparse transition rates: {} states, {} transitions".format(
+                self.states_number, self.trm_c.nnz + len(self.trm_rows)))
+
+            return self.trm_functions()
+
+        self.trm_c, self.trm_rows, self.trm_cols, self.trm_values, self.trm_index, self.trm_stimuli, self.trm_n = \
+            self.trm_compile()
+        self.trm_diag = np.diag_indices(self.states_number)
+
+        trm_r = self.trm_c.copy()
+        trm_r[self.trm_rows, self.trm_cols] = self.trm_values                # rate value no time matrix
 
         log.info("### Zero time transition rates (i(row) -> j(column):")
         log.info([state.name for state in self.states])
-        log.info(np.array(trm_r))
+        log.info(trm_r)
 
+        return self.trm_functions()
+
+    def trm_functions(self):
+        """
+        :return: functions returning time dependant transition rate matrix, normalized and raw
+        """
         def trm_fn(t):
-            trm_tn = np.array([[rate.value * rate.stimulus(t) if rate.stimulus else rate.value for rate in row]
-                              for row in trm])                                   # rate value with stimulus
-            trm_tn[np.diag_indices_from(trm_tn)] = -1 * np.sum(trm_tn, axis=1)   # row normalization
-            return trm_tn
+            return self.trm_evaluate(self.trm_levels(t))
 
         def trm_f(t):
-            trm_t = np.array([[rate.value * rate.stimulus(t) if rate.stimulus else rate.value for rate in row]
-                              for row in trm])                                   # rate value with stimulus
-            return trm_t
+            return self.trm_evaluate(self.trm_levels(t), normalize=False)
 
         return trm_fn, trm_f
 
+    def trm_multiples(self, name):
+        """
+        finds rates named as multiples of given rate ('2kon' for 'kon'), as in hand written and generated mechanisms
+        :param name: rate name
+        :return: dictionary (rate name: multiplier), given rate included
+        """
+        names = set(rate.name for state in self.states for _, rate in state.transitions())
+        multiples = {multiple: int(multiple[:-len(name)]) for multiple in names if re.fullmatch(r'\d+' + re.escape(name), multiple)}
+        multiples[name] = 1
+        return multiples
+
+    def with_stimulus(self, stimulus):
+        """
+        copy sharing compiled arrays, with all stimuli replaced by given one (state and rate objects keep
+        original stimuli, compiled arrays are used by solvers)
+        :param stimulus: new stimulus
+        :return: Kinetic object
+        """
+        model = copy.copy(self)
+        model.trm_stimuli = [stimulus for _ in self.trm_stimuli]
+        model.trmn, model.trm = model.trm_functions()
+        return model
+
 
 class Stimulus:
     """
-    stimulus shall be defined as static method returning time dependant function returning single scalar for
-    given time, notice, that time value is passed by integrator
+    time dependant rate multiplier, called with scalar or array of times (array evaluation for plotting and
+    solvers); edges lists times where stimulus changes its form (discontinuities, ramp corners), constant
+    tells if stimulus is piecewise constant in between; stimuli can be added and multiplied
     """
+    constant = True
+
+    def __call__(self, t):
+        value = self.evaluate(np.asarray(t, dtype=float))
+        return float(value) if np.ndim(t) == 0 else value
+
+    def evaluate(self, t):
+        """
+        :param t: array of times
+        :return: array of stimulus values
+        """
+        raise NotImplementedError
+
+    @property
+    def edges(self):
+        return []
+
+    def segments(self, t0, te):
+        """
+        splits time range at edges
+        :param t0: starting time
+        :param te: ending time
+        :return: list of (start, end, value) tuples, value is None within non-constant segments
+        """
+        bounds = [t0] + sorted(set(edge for edge in self.edges if t0 < edge < te)) + [te]
+        return [(start, end, self(0.5 * (start + end)) if self.constant else None)
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def __add__(self, other):
+        return StimulusSum(self, other if isinstance(other, Stimulus) else Constant(other))
+
+    def __mul__(self, other):
+        return StimulusProduct(self, other if isinstance(other, Stimulus) else Constant(other))
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(repr(value) for value in vars(self).values()))
 
     @staticmethod
     def square(a, b, v):
@@ -89,31 +343,153 @@ class Stimulus:
         :param a: step start time
         :param b: step end time
         :param v: step height (rate multiplication)
-        :return: time dependant function
+        :return: Square stimulus
         """
-        def square_t(t):
-            if a <= t < b:
-                return v
-            else:
-                return 0
-        return square_t
+        return Square(a, b, v)
 
     @staticmethod
     def pair_square(a, b, v):
         """
         square stimulus
-        :param a: step start times
-        :param b: step end times
+        :param a: first step start and end times
+        :param b: second step start and end times
         :param v: step height (rate multiplication)
-        :return: time dependant function
+        :return: PulseTrain stimulus
         """
-        def square_t(t):
-            if a[0] <= t < a[1] or b[0] <= t < b[1]:
-                return v
-            else:
-                return 0
-        return square_t
+        return PulseTrain([a[0], b[0]], [a[1], b[1]], v)
+
+
+class Constant(Stimulus):
+
+    def __init__(self, v):
+        """
+        :param v: value
+        """
+        self.v = v
+
+    def evaluate(self, t):
+        return np.full(t.shape, self.v, dtype=float)
+
+
+class Square(Stimulus):
+
+    def __init__(self, a, b, v):
+        """
+        :param a: step start time
+        :param b: step end time
+        :param v: step height
+        """
+        self.a, self.b, self.v = a, b, v
+
+    def evaluate(self, t):
+        return np.where((self.a <= t) & (t < self.b), float(self.v), 0.)
+
+    @property
+    def edges(self):
+        return [self.a, self.b]
+
+
+class PulseTrain(Stimulus):
+
+    def __init__(self, starts, ends, v):
+        """
+        :param starts: pulse start times
+        :param ends: pulse end times
+        :param v: pulse height
+        """
+        self.starts, self.ends, self.v = list(starts), list(ends), v
+
+    @classmethod
+    def regular(cls, start, width, interval, number, v):
+        """
+        :param start: first pulse start time
+        :param width: pulse width
+        :param interval: pulse start to pulse start interval
+        :param number: number of pulses
+        :param v: pulse height
+        :return: PulseTrain stimulus
+        """
+        starts = [start + idx * interval for idx in range(number)]
+        return cls(starts, [pulse + width for pulse in starts], v)
+
+    def evaluate(self, t):
+        inside = np.zeros(t.shape, dtype=bool)
+        for start, end in zip(self.starts, self.ends):
+            inside |= (start <= t) & (t < end)
+        return np.where(inside, float(self.v), 0.)
+
+    @property
+    def edges(self):
+        return self.starts + self.ends
+
+
+class Ramp(Stimulus):
+    constant = False
+
+    def __init__(self, a, b, v0, v1):
+        """
+        linear ramp, zero outside
+        :param a: ramp start time
+        :param b: ramp end time
+        :param v0: value at ramp start
+        :param v1: value at ramp end
+        """
+        self.a, self.b, self.v0, self.v1 = a, b, v0, v1
+
+    def evaluate(self, t):
+        return np.where((self.a <= t) & (t < self.b), self.v0 + (self.v1 - self.v0) * (t - self.a) / (self.b - self.a), 0.)
+
+    @property
+    def edges(self):
+        return [self.a, self.b]
+
+
+class ExpExchange(Stimulus):
+    constant = False
+
+    def __init__(self, a, b, v, tau_on, tau_off):
+        """
+        solution exchange with exponential wash-in at start and wash-out at end
+        :param a: exchange start time
+        :param b: exchange end time
+        :param v: final value
+        :param tau_on: wash-in time constant
+        :param tau_off: wash-out time constant
+        """
+        self.a, self.b, self.v, self.tau_on, self.tau_off = a, b, v, tau_on, tau_off
+
+    def evaluate(self, t):
+        rise = self.v * (1 - np.exp(-(np.clip(t, self.a, self.b) - self.a) / self.tau_on))
+        decay = np.exp(-np.clip(t - self.b, 0., None) / self.tau_off)
+        return np.where(t < self.a, 0., rise * decay)
+
+    @property
+    def edges(self):
+        return [self.a, self.b]
+
+
+class StimulusSum(Stimulus):
+
+    def __init__(self, first, second):
+        """
+        :param first: stimulus
+        :param second: stimulus
+        """
+        self.first, self.second = first, second
+
+    @property
+    def constant(self):
+        return self.first.constant and self.second.constant
+
+    def evaluate(self, t):
+        return self.first.evaluate(t) + self.second.evaluate(t)
 
+    @property
+    def edges(self):
+        return sorted(set(self.first.edges + self.second.edges))
 
 
+class StimulusProduct(StimulusSum):
 
+    def evaluate(self, t):
+        return self.first.evaluate(t) * self.second.evaluate(t)
@@ -1,10 +1,218 @@
 import logging as log
+import functools
 import numpy as np
 from mm_kinetic import Kinetic
 from mm_kinetic import Stimulus
 
 # model definition #
 
+# mechanisms registry: rates (name: value), stimulated (concentration dependant rates) and states
+# (name, initial probability, category, transitions {target state: rate name}), compiled once per session
+
+MODELS = {
+    'kisiel': {
+        'rates': {
+            'kon':      2 * 1e7 * 1e-6,
+            '2kon':     2 * 2 * 1e7 * 1e-6,
+            'koff':     1116*1e-3,
+            '2koff':    2*1116*1e-3,
+            'b1':       150*1e-3,
+            'b2':       18000*1e-3,
+            'b3':       35*1e-3,
+            'b4':       200*1e-3,
+            'b5':       100*1e-3,
+            'a1':       20000*1e-3,
+            'a2':       800*1e-3,
+            'a3':       3333*1e-3,
+            'a4':       17500*1e-3,
+            'a5':       3000*1e-3,
+            'd1':       310*1e-3,
+            'd2':       800*1e-3,
+            'd4':       1000*1e-3,
+            'r1':       5*1e-3,
+            'r2':       400*1e-3,
+            'r4':       10*1e-3,
+            'y2':       4400*1e-3,
+            'g2':       4300*1e-3,
+        },
+        'stimulated': ['kon', '2kon'],
+        'states': [
+            ('A1O', 0, 'open',          {'A1R': 'a1', 'A1D': 'd1'}),
+            ('A2O', 0, 'open',          {'A2F': 'a2'}),
+            ('A3O', 0, 'open',          {'A1D': 'a3'}),
+            ('A4O', 0, 'open',          {'A2R': 'a4', 'A4D': 'd4'}),
+            ('A5O', 0, 'open',          {'A4D': 'a5'}),
+            ('R',   1, 'unbound',       {'A1R': '2kon'}),
+            ('A1R', 0, 'single-bound',  {'A1O': 'a1', 'R': 'koff', 'A2R': 'kon'}),
+            ('A2R', 0, 'double-bound',  {'A4O': 'b4', 'A1R': '2koff', 'A2F': 'g2'}),
+            ('A2F', 0, 'flipped',       {'A2O': 'b2', 'A2R': 'y2', 'A2D': 'd2'}),
+            ('A1D', 0, 'desensitized',  {'A1O': 'r1', 'A3O': 'b3'}),
+            ('A2D', 0, 'desensitized',  {'A2F': 'r2'}),
+            ('A4D', 0, 'desensitized',  {'A4O': 'r4', 'A5O': 'b5'}),
+        ],
+    },
+    'jwm': {
+        'rates': {
+            'kon':      2.00,
+            '2kon':     4.00,
+            'koff':     4.00,
+            '2koff':    8.00,
+            'd':        1.00,
+            'r':        0.70,
+            'b':        5.00,
+            'a':        3.00,
+        },
+        'stimulated': ['kon', '2kon'],
+        'states': [
+            ('R',   1, False,   {'AR': '2kon'}),
+            ('AR',  0, False,   {'R': 'koff', 'A2R': 'kon'}),
+            ('A2R', 0, False,   {'AR': '2koff', 'A2D': 'd', 'A2O': 'b'}),
+            ('A2D', 0, False,   {'A2R': 'r'}),
+            ('A2O', 0, True,    {'A2R': 'a'}),
+        ],
+    },
+    'fjwm': {
+        'rates': {
+            'kon':      9.9,
+            '2kon':     19.8,
+            'koff':     1.16,
+            '2koff':    2.32,
+            'd':        23.8,
+            'r':        0.12,
+            'b':        16.5,
+            'a':        1.69,
+            'y':        4.46,
+            'g':        4.03,
+            'mf':       0.00,
+            'mb':       0.00,
+            'sf':       0.001,
+            'sb':       0.03,
+        },
+        'stimulated': ['kon', '2kon'],
+        'states': [
+            ('R',   100, 'unbound',         {'AR': '2kon', 'S': 'sf'}),
+            ('AR',  0,   'single-bound',    {'R': 'koff', 'A2R': 'kon'}),
+            ('A2R', 0,   'double-bound',    {'AR': '2koff', 'A2F': 'y', 'A2D': 'mf'}),
+            ('A2F', 0,   'flipped',         {'AR': '2koff', 'A2R': 'g', 'A2D': 'd', 'A2O': 'b'}),
+            ('A2D', 0,   'desensitized',    {'A2R': 'mb', 'A2F': 'r'}),
+            ('A2O', 0,   'open',            {'A2F': 'a'}),
+            ('S',   0,   'open',            {'R': 'sb'}),
+        ],
+    },
+    'STOP_fjwm': {
+        'rates': {
+            'kon':      0.10,
+            '2kon':     0.20,
+            'koff':     1.16,
+            '2koff':    2.32,
+            'd':        28.8,
+            'r':        0.21,
+            'b':        16.5,
+            'a':        1.69,
+            'y':        195,
+            'g':        0.27,
+            'mf':       0.00,
+            'mb':       0.00,
+        },
+        'stimulated': ['kon', '2kon'],
+        'states': [
+            ('R',   100, 'unbound',         {'AR': '2kon'}),
+            ('AR',  0,   'single-bound',    {'R': 'koff', 'A2R': 'kon'}),
+            ('A2R', 0,   'double-bound',    {'AR': '2koff', 'A2F': 'y', 'A2D': 'mf'}),
+            ('A2F', 0,   'flipped',         {'AR': '2koff', 'A2R': 'g', 'A2D': 'd', 'A2O': 'b'}),
+            ('A2D', 0,   'desensitized',    {'A2R': 'mb', 'A2F': 'r'}),
+            ('A2O', 0,   'open',            {'A2F': 'a'}),
+        ],
+    },
+    'sfjwm': {
+        'rates': {
+            'kon':      9.9,
+            '2kon':     19.8,
+            'koff':     1.16,
+            '2koff':    2.32,
+            'd':        23.8,
+            'r':        0.12,
+            'b':        16.5,
+            'a':        1.69,
+            'y':        4.46,
+            'g':        4.03,
+            's1f':      0.001,
+            's1b':      15,
+            's2f':      0.5,
+            's2b':      4.0,
+            'sdf':      1.0,
+            'sdb':      0.5,
+        },
+        'stimulated': ['kon', '2kon'],
+        'states': [
+            ('R',   100, 'unbound',         {'AR': '2kon', 'RS1': 's1f'}),
+            ('AR',  0,   'single-bound',    {'R': 'koff', 'A2R': 'kon'}),
+            ('A2R', 0,   'double-bound',    {'AR': '2koff', 'A2F': 'y'}),
+            ('A2F', 0,   'flipped',         {'AR': '2koff', 'A2R': 'g', 'A2D': 'd', 'A2O': 'b'}),
+            ('A2D', 0,   'desensitized',    {'A2F': 'r'}),
+            ('A2O', 0,   'open',            {'A2F': 'a'}),
+            ('RS1', 0,   'open',            {'R': 's1b', 'RSD': 'sdf'}),
+            ('RSD', 0,   'desensitized',    {'RS1': 'sdb', 'RS2': 's2f'}),
+            ('RS2', 0,   'open',            {'RSD': 's2b'}),
+        ],
+    },
+    'spont18': {
+        'rates': {
+            'b0':       0.50,                   # ?
+            'a0':       19.5,                   # sum-fit do short shut single (20.50)
+            'd0':       1.00,                   # jw
+            'r0':       0.50,                   # Kisiel17
+            'b0p':      0.25,                   # manual (10% stanów RO2 w singlu)
+            'a0p':      3.64,                   # fit do long shut single channel
+            'bon':      12.00,                  # ok. 5e4 wysyca, nisko żeby nie było peak'u
+            'bof':      0.01,                   # musi być wolno (deaktywacja)
+            'bm':       6.00,                   # ?
+            'am':       10.37,                  # sum-fit do short shut single (14.37)
+            'dm':       4.00,                   # jw
+            'rm':       0.25,                   # manual
+            'bmp':      0.01,                   # manual (10% stanów RMO2 w singlu)
+            'amp':      2.15,                   # fit do long shut single channel
+        },
+        'stimulated': ['bon'],
+        'states': [
+            ('R',    100, 'unbound',    {'RO1': 'b0', 'RM': 'bon'}),
+            ('RO1',  0,   'open',       {'R': 'a0', 'RD': 'd0'}),
+            ('RD',   0,   'unbound',    {'RO1': 'r0', 'RO2': 'b0p'}),
+            ('RO2',  0,   'open',       {'RD': 'a0p'}),
+            ('RM',   0,   'unbound',    {'R': 'bof', 'RMO1': 'bm'}),
+            ('RMO1', 0,   'open',       {'RM': 'am', 'RMD': 'dm'}),
+            ('RMD',  0,   'unbound',    {'RMO1': 'rm', 'RMO2': 'bmp'}),
+            ('RMO2', 0,   'open',       {'RMD': 'amp'}),
+        ],
+    },
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_model(model, sparse=False):
+    """
+    builds Kinetic object of registered mechanism, once per session; concentration dependant rates get unit
+    stimulus placeholder, to be replaced with Kinetic.with_stimulus
+    :param model: registered mechanism name
+    :param sparse: sparse transition rate matrix storage
+    :return: Kinetic object
+    """
+    mechanism = MODELS[model]
+    placeholder = Stimulus.square(-np.inf, np.inf, 1.0)
+
+    log.info("### Adding rates:")
+    rates = {name: Kinetic.State.Rate(name, value, placeholder if name in mechanism['stimulated'] else False)
+             for name, value in mechanism['rates'].items()}
+    r_0 = Kinetic.State.Rate('block', 0.00)
+
+    log.info("### Adding states:")
+    names = [state[0] for state in mechanism['states']]
+    states = [Kinetic.State(no, name, [rates[transitions[target]] if target in transitions else r_0 for target in names], border, category)
+              for no, (name, border, category, transitions) in enumerate(mechanism['states'])]
+
+    return Kinetic(states, sparse)
+
+
 class ModelBuilder:
     """
     wrapper for mm_kinetic, creates list of models of given type with selected stimulus
@@ -12,7 +220,7 @@ class ModelBuilder:
     def __init__(self, model, agonist_concentrations, stimulus):
         """
 
-        :param model: state/rate set selection 'jwm', 'kisiel'
+        :param model: state/rate set selection, any of MODELS ('jwm', 'kisiel', ...)
         :param concentrations: list of agonist concentrations
         :param new_stimulus: stimulus type
         :return:
@@ -35,262 +243,62 @@ class ModelBuilder:
 
     def build_models(self):
         """
+        compiled mechanism is shared, only stimulus (concentration) differs between models
         :return:
         """
+        compiled = compile_model(self.model)
+
         for conc in self.agonist_concentrations:
 
             if self.stimulus == 'pair':
                 new_stimulus = Stimulus.pair_square([0., 500.], [600., 1100.], 10.0)
-                # suspend = [[5., 10.], [15., 20.]]
             if self.stimulus == 'single':
                 new_stimulus = Stimulus.square(500., 1500., conc)
-                # suspend = [[2.5], [10.]]
 
             self.stimuli.append(new_stimulus)
-
-            log.info("### Adding rates:")
-
-            if self.model == 'kisiel':
-
-                r_kon   = Kinetic.State.Rate('kon',     2 * 1e7 * 1e-6,     new_stimulus)
-                r_2kon  = Kinetic.State.Rate('2kon',    2 * 2 * 1e7 * 1e-6, new_stimulus)
-                r_koff  = Kinetic.State.Rate('koff',    1116*1e-3)
-                r_2koff = Kinetic.State.Rate('2koff',   2*1116*1e-3)
-                r_b1    = Kinetic.State.Rate('b1',      150*1e-3)
-                r_b2    = Kinetic.State.Rate('b2',      18000*1e-3)
-                r_b3    = Kinetic.State.Rate('b3',      35*1e-3)
-                r_b4    = Kinetic.State.Rate('b4',      200*1e-3)
-                r_b5    = Kinetic.State.Rate('b5',      100*1e-3)
-                r_a1    = Kinetic.State.Rate('a1',      20000*1e-3)
-                r_a2    = Kinetic.State.Rate('a2',      800*1e-3)
-                r_a3    = Kinetic.State.Rate('a3',      3333*1e-3)
-                r_a4    = Kinetic.State.Rate('a4',      17500*1e-3)
-                r_a5    = Kinetic.State.Rate('a5',      3000*1e-3)
-                r_d1    = Kinetic.State.Rate('d1',      310*1e-3)
-                r_d2    = Kinetic.State.Rate('d2',      800*1e-3)
-                r_d4    = Kinetic.State.Rate('d4',      1000*1e-3)
-                r_r1    = Kinetic.State.Rate('r1',      5*1e-3)
-                r_r2    = Kinetic.State.Rate('r2',      400*1e-3)
-                r_r4    = Kinetic.State.Rate('r4',      10*1e-3)
-                r_y2    = Kinetic.State.Rate('y2',      4400*1e-3)
-                r_g2    = Kinetic.State.Rate('g2',      4300*1e-3)
-                r_0     = Kinetic.State.Rate('block',   0.00*1e-3)
-
-            if self.model == 'jwm':
-
-                r_kon   = Kinetic.State.Rate('kon',     2.00, new_stimulus)
-                r_2kon  = Kinetic.State.Rate('2kon',    4.00, new_stimulus)
-                r_koff  = Kinetic.State.Rate('koff',    4.00)
-                r_2koff = Kinetic.State.Rate('2koff',   8.00)
-                r_d     = Kinetic.State.Rate('d',       1.00)
-                r_r     = Kinetic.State.Rate('r',       0.70)
-                r_b     = Kinetic.State.Rate('b',       5.00)
-                r_a     = Kinetic.State.Rate('a',       3.00)
-                r_0     = Kinetic.State.Rate('block',   0.00)
-
-            if self.model == 'fjwm':
-                r_kon   = Kinetic.State.Rate('kon',     9.9, new_stimulus)
-                r_2kon  = Kinetic.State.Rate('2kon',    19.8, new_stimulus)
-                r_koff  = Kinetic.State.Rate('koff',    1.16)
-                r_2koff = Kinetic.State.Rate('2koff',   2.32)
-                r_d     = Kinetic.State.Rate('d',       23.8)
-                r_r     = Kinetic.State.Rate('r',       0.12)
-                r_b     = Kinetic.State.Rate('b',       16.5)
-                r_a     = Kinetic.State.Rate('a',       1.69)
-                r_y     = Kinetic.State.Rate('y',       4.46)
-                r_g     = Kinetic.State.Rate('g',       4.03)
-                r_mf    = Kinetic.State.Rate('mf',      0.00)
-                r_mb    = Kinetic.State.Rate('mb',      0.00)
-                r_sf    = Kinetic.State.Rate('sf',      0.001)
-                r_sb    = Kinetic.State.Rate('sb',      0.03)
-                r_0     = Kinetic.State.Rate('block',   0.00)
-
-            if self.model == 'STOP_fjwm':
-                r_kon   = Kinetic.State.Rate('kon',     0.10, new_stimulus)
-                r_2kon  = Kinetic.State.Rate('2kon',    0.20, new_stimulus)
-                r_koff  = Kinetic.State.Rate('koff',    1.16)
-                r_2koff = Kinetic.State.Rate('2koff',   2.32)
-                r_d     = Kinetic.State.Rate('d',       28.8)
-                r_r     = Kinetic.State.Rate('r',       0.21)
-                r_b     = Kinetic.State.Rate('b',       16.5)
-                r_a     = Kinetic.State.Rate('a',       1.69)
-                r_y     = Kinetic.State.Rate('y',       195)
-                r_g     = Kinetic.State.Rate('g',       0.27)
-                r_mf    = Kinetic.State.Rate('mf',      0.00)
-                r_mb    = Kinetic.State.Rate('mb',      0.00)
-                r_0     = Kinetic.State.Rate('block',   0.00)
-
-                '''
-                if self.model == 'kisiel_17':
-                    r_kon = Kinetic.State.Rate('kon', 43.2, new_stimulus)
-                    r_2kon = Kinetic.State.Rate('2kon', 86.4, new_stimulus)
-                    r_koff = Kinetic.State.Rate('koff', 1.82)
-                    r_2koff = Kinetic.State.Rate('2koff', 3.64)
-                    r_a0 = Kinetic.State.Rate('a0 ', 23.8)
-                    r_r = Kinetic.State.Rate('r', 0.12)
-                    r_b = Kinetic.State.Rate('b', 16.5)
-                    r_a = Kinetic.State.Rate('a', 1.69)
-                    r_y = Kinetic.State.Rate('y', 4.46)
-                    r_g = Kinetic.State.Rate('g', 4.03)
-                    r_s1f = Kinetic.State.Rate('s1f', 0.001)
-                    r_s1b = Kinetic.State.Rate('s1b', 15)
-                    r_s2f = Kinetic.State.Rate('s2f', 0.5)
-                    r_s2b = Kinetic.State.Rate('s2b', 4.0)
-                    r_sdf = Kinetic.State.Rate('sdf', 1.0)
-                    r_sdb = Kinetic.State.Rate('sdb', 0.5)
-                    r_0 = Kinetic.State.Rate('block', 0.00)
-                '''
-
-            log.info("### Adding states:")
-
-            if self.model == 'kisiel':
-
-                #                                  A1O      A2O     A3O     A40     A50     R       A1R     A2R     A2F     A1D     A2D     A4D
-                st_a1o  = Kinetic.State(0, 'A1O', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_a1,   r_0,    r_0,    r_d1,   r_0,    r_0],   0, 'open')
-                st_a2o  = Kinetic.State(1, 'A2O', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_a2,   r_0,    r_0,    r_0],   0, 'open')
-                st_a3o  = Kinetic.State(2, 'A3O', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_a3,   r_0,    r_0],   0, 'open')
-                st_a4o  = Kinetic.State(3, 'A4O', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_a4,   r_0,    r_0,    r_0,    r_d4],  0, 'open')
-                st_a5o  = Kinetic.State(4, 'A5O', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_a5],  0, 'open')
-                st_r    = Kinetic.State(5, 'R'  , [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_2kon, r_0,    r_0,    r_0,    r_0,    r_0],   1, 'unbound')
-                st_a1r  = Kinetic.State(6, 'A1R', [r_a1,    r_0,    r_0,    r_0,    r_0,    r_koff, r_0,    r_kon,  r_0,    r_0,    r_0,    r_0],   0, 'single-bound')
-                st_a2r  = Kinetic.State(7, 'A2R', [r_0,     r_0,    r_0,    r_b4,   r_0,    r_0,    r_2koff,r_0,    r_g2,   r_0,    r_0,    r_0],   0, 'double-bound')
-                st_a2f  = Kinetic.State(8, 'A2F', [r_0,     r_b2,   r_0,    r_0,    r_0,    r_0,    r_0,    r_y2,    r_0,   r_0,    r_d2,   r_0],   0, 'flipped')
-                st_a1d  = Kinetic.State(9, 'A1D', [r_r1,    r_0,    r_b3,   r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0],   0, 'desensitized')
-                st_a2d  = Kinetic.State(10,'A2D', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_r2,   r_0,    r_0,    r_0],   0, 'desensitized')
-                st_a4d  = Kinetic.State(11,'A4D', [r_0,     r_0,    r_0,    r_r4,   r_b5,   r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0],   0, 'desensitized')
-
-            if self.model == 'jwm':
-
-                st_r    = Kinetic.State(0, 'R',   [r_0,     r_2kon,   r_0,    r_0,  r_0],   1, False)
-                st_ar   = Kinetic.State(1, 'AR',  [r_koff,  r_0,      r_kon,  r_0,  r_0],   0, False)
-                st_a2r  = Kinetic.State(2, 'A2R', [r_0,     r_2koff,  r_0,    r_d,  r_b],   0, False)
-                st_a2d  = Kinetic.State(3, 'A2D', [r_0,     r_0,      r_r,    r_0,  r_0],   0, False)
-                st_a2o  = Kinetic.State(4, 'A2O', [r_0,     r_0,      r_a,    r_0,  r_0],   0, True)
-
-            if self.model == 'STOP_fjwm':
-
-                #                                  R        AR        A2R     A2F   A2D   A2O
-                st_r    = Kinetic.State(0, 'R',   [r_0,     r_2kon,   r_0,    r_0,  r_0,  r_0],   100, 'unbound')
-                st_ar   = Kinetic.State(1, 'AR',  [r_koff,  r_0,      r_kon,  r_0,  r_0,  r_0],   0, 'single-bound')
-                st_a2r  = Kinetic.State(2, 'A2R', [r_0,     r_2koff,  r_0,    r_y,  r_mf, r_0],   0, 'double-bound')
-                st_a2f  = Kinetic.State(3, 'A2F', [r_0,     r_2koff,  r_g,    r_0,  r_d,  r_b],   0, 'flipped')
-                st_a2d  = Kinetic.State(4, 'A2D', [r_0,     r_0,      r_mb,   r_r,  r_0,  r_0],   0, 'desensitized')
-                st_a2o  = Kinetic.State(5, 'A2O', [r_0,     r_0,      r_0,    r_a,  r_0,  r_0],   0, 'open')
-
-            if self.model == 'fjwm':
-
-                #                                  R        AR        A2R     A2F   A2D   A2O   S
-                st_r    = Kinetic.State(0, 'R',   [r_0,     r_2kon,   r_0,    r_0,  r_0,  r_0,  r_sf,],   100, 'unbound')
-                st_ar   = Kinetic.State(1, 'AR',  [r_koff,  r_0,      r_kon,  r_0,  r_0,  r_0,  r_0,],   0, 'single-bound')
-                st_a2r  = Kinetic.State(2, 'A2R', [r_0,     r_2koff,  r_0,    r_y,  r_mf, r_0,  r_0,],   0, 'double-bound')
-                st_a2f  = Kinetic.State(3, 'A2F', [r_0,     r_2koff,  r_g,    r_0,  r_d,  r_b,  r_0,],   0, 'flipped')
-                st_a2d  = Kinetic.State(4, 'A2D', [r_0,     r_0,      r_mb,   r_r,  r_0,  r_0,  r_0,],   0, 'desensitized')
-                st_a2o  = Kinetic.State(5, 'A2O', [r_0,     r_0,      r_0,    r_a,  r_0,  r_0,  r_0,],   0, 'open')
-                st_so   = Kinetic.State(6,  'S',  [r_sb,    r_0,      r_0,    r_0,  r_0,  r_0,  r_0,],   0, 'open' )
-
-            if self.model == 'sfjwm':
-
-                r_kon   = Kinetic.State.Rate('kon',     9.9, new_stimulus)
-                r_2kon  = Kinetic.State.Rate('2kon',    19.8, new_stimulus)
-                r_koff  = Kinetic.State.Rate('koff',    1.16)
-                r_2koff = Kinetic.State.Rate('2koff',   2.32)
-                r_d     = Kinetic.State.Rate('d',       23.8)
-                r_r     = Kinetic.State.Rate('r',       0.12)
-                r_b     = Kinetic.State.Rate('b',       16.5)
-                r_a     = Kinetic.State.Rate('a',       1.69)
-                r_y     = Kinetic.State.Rate('y',       4.46)
-                r_g     = Kinetic.State.Rate('g',       4.03)
-                r_s1f   = Kinetic.State.Rate('s1f',     0.001)
-                r_s1b   = Kinetic.State.Rate('s1b',     15)
-                r_s2f   = Kinetic.State.Rate('s2f',     0.5)
-                r_s2b   = Kinetic.State.Rate('s2b',     4.0)
-                r_sdf   = Kinetic.State.Rate('sdf',     1.0)
-                r_sdb   = Kinetic.State.Rate('sdb',     0.5)
-                r_0     = Kinetic.State.Rate('block',   0.00)
-
-                #                                  R         AR        A2R     A2F   A2D   A2O   RS1     RSD     RS2
-                st_r    = Kinetic.State(0, 'R',    [r_0,     r_2kon,   r_0,    r_0,  r_0,  r_0,  r_s1f,  r_0,    r_0  ],   100, 'unbound')
-                st_ar   = Kinetic.State(1, 'AR',   [r_koff,  r_0,      r_kon,  r_0,  r_0,  r_0,  r_0,    r_0,    r_0  ],   0, 'single-bound')
-                st_a2r  = Kinetic.State(2, 'A2R',  [r_0,     r_2koff,  r_0,    r_y,  r_0,  r_0,  r_0,    r_0,    r_0  ],   0, 'double-bound')
-                st_a2f  = Kinetic.State(3, 'A2F',  [r_0,     r_2koff,  r_g,    r_0,  r_d,  r_b,  r_0,    r_0,    r_0  ],   0, 'flipped')
-                st_a2d  = Kinetic.State(4, 'A2D',  [r_0,     r_0,      r_0,    r_r,  r_0,  r_0,  r_0,    r_0,    r_0  ],   0, 'desensitized')
-                st_a2o  = Kinetic.State(5, 'A2O',  [r_0,     r_0,      r_0,    r_a,  r_0,  r_0,  r_0,    r_0,    r_0  ],   0, 'open')
-                st_rs1   = Kinetic.State(6, 'RS1', [r_s1b,   r_0,      r_0,    r_0,  r_0,  r_0,  r_0,    r_sdf,  r_0  ],   0, 'open' )
-                st_rsd   = Kinetic.State(7, 'RSD', [r_0,     r_0,      r_0,    r_0,  r_0,  r_0,  r_sdb,  r_0,    r_s2f],   0, 'desensitized' )
-                st_rs2   = Kinetic.State(8, 'RS2', [r_0,     r_0,      r_0,    r_0,  r_0,  r_0,  r_0,    r_s2b,  r_0  ],   0, 'open' )
-
-            if self.model == 'spont18':
-
-                r_b0  = Kinetic.State.Rate('b0',    0.50)                   # ?
-                r_a0  = Kinetic.State.Rate('a0',    19.5)                   # sum-fit do short shut single (20.50)
-                r_d0  = Kinetic.State.Rate('d0',    1.00)                   # jw
-                r_r0  = Kinetic.State.Rate('r0',    0.50)                   # Kisiel17
-                r_b0p = Kinetic.State.Rate('b0p',   0.25)                   # manual (10% stanów RO2 w singlu)
-                r_a0p = Kinetic.State.Rate('a0p',   3.64)                   # fit do long shut single channel
-
-                r_onm = Kinetic.State.Rate('bon',   12.00, new_stimulus)    # ok. 5e4 wysyca, nisko żeby nie było peak'u
-                r_ofm = Kinetic.State.Rate('bof',   0.01)                  # musi być wolno (deaktywacja)
-                r_bm  = Kinetic.State.Rate('bm',    6.00)                   # ?
-                r_am  = Kinetic.State.Rate('am',    10.37)                   # sum-fit do short shut single (14.37)
-                r_dm  = Kinetic.State.Rate('dm',    4.00)                   # jw
-                r_rm  = Kinetic.State.Rate('rm',    0.25)                   # manual
-                r_bmp = Kinetic.State.Rate('bmp',   0.01)                   # manual (10% stanów RMO2 w singlu)
-                r_amp = Kinetic.State.Rate('amp',   2.15)                   # fit do long shut single channel
-
-                r_0   = Kinetic.State.Rate('block',   0.00)
-
-                #                                     R        RO1     RD      RO2     RM      RMO1    RMD     RMO2
-                st_r      = Kinetic.State(0, 'R',    [r_0,     r_b0,   r_0,    r_0,    r_onm,  r_0,    r_0,    r_0,],   100,  'unbound')
-                st_ro1    = Kinetic.State(1, 'RO1',  [r_a0,    r_0,    r_d0,   r_0,    r_0,    r_0,    r_0,    r_0,],   0,    'open')
-                st_rd     = Kinetic.State(2, 'RD',   [r_0,     r_r0,   r_0,    r_b0p,  r_0,    r_0,    r_0,    r_0,],   0,    'unbound')
-                st_ro2    = Kinetic.State(3, 'RO2',  [r_0,     r_0,    r_a0p,  r_0,    r_0,    r_0,    r_0,    r_0,],   0,    'open')
-                st_rm     = Kinetic.State(4, 'RM',   [r_ofm,   r_0,    r_0,    r_0,    r_0,    r_bm,   r_0,    r_0,],   0,    'unbound')
-                st_rmo1   = Kinetic.State(5, 'RMO1', [r_0,     r_0,    r_0,    r_0,    r_am,   r_0,    r_dm,   r_0,],   0,    'open')
-                st_rmd    = Kinetic.State(6, 'RMD',  [r_0,     r_0,    r_0,    r_0,    r_0,    r_rm,   r_0,    r_bmp,], 0,    'unbound')
-                st_rmo2   = Kinetic.State(7, 'RMO2', [r_0,     r_0,    r_0,    r_0,    r_0,    r_0,    r_amp,  r_0,],   0,    'open')
-
-                self.states = [st_r, st_ro1, st_rd, st_ro2, st_rm, st_rmo1, st_rmd, st_rmo2]
-                model_kinetic = Kinetic(self.states)
-
-            '''
-            if self.model == 'kisiel_17':
-
-                #                                       SO1     SO2     A1O1    A2O2    A2OSH1  A2OSH2  A2O     R       SC      A1R     A1F     A1D     A2R     A2DSH   A2F     A2D1    A2D2
-                st_so1    = Kinetic.State(0, 'SO1',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_so2    = Kinetic.State(0, 'SO2',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a1o1   = Kinetic.State(0, 'A1O1',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a1o2   = Kinetic.State(0, 'A1O2',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a2osh1 = Kinetic.State(0, 'A2OSH1', [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,],    0, 'open')
-                st_a2osh2 = Kinetic.State(0, 'A2OSH2', [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,],    0, 'open')
-                st_a2o    = Kinetic.State(0, 'A2O',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
-                st_r      = Kinetic.State(0, 'R',      [?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_sc     = Kinetic.State(0, 'SC',     [?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a1r    = Kinetic.State(0, 'A1R',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    ?,      r_0,    ?,      r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a1f    = Kinetic.State(0, 'A1F',    [r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a1d    = Kinetic.State(0, 'A1D',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a2r    = Kinetic.State(0, 'A2R',    [r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
-                st_a2dsh  = Kinetic.State(0, 'A2DSH',  [r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
-                st_a2f    = Kinetic.State(0, 'A2F',    [r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    ?,       ?, ],    0, 'open')
-                st_a2d1   = Kinetic.State(0, 'A2D1',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
-                st_a2d2   = Kinetic.State(0, 'A2D2',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
-            '''
-
-            if self.model == 'kisiel':
-
-                self.states = [st_a1o, st_a2o, st_a3o, st_a4o, st_a5o, st_r, st_a1r, st_a2r, st_a2f, st_a1d, st_a2d, st_a4d]
-                model_kinetic = Kinetic(self.states)
-
-            if self.model == 'jwm':
-                self.states = [st_r, st_ar, st_a2r, st_a2d, st_a2o]
-                model_kinetic = Kinetic(self.states)
-
-            if self.model == 'fjwm':
-                self.states = [st_r, st_ar, st_a2r, st_a2f, st_a2d, st_a2o, st_so]
-                model_kinetic = Kinetic(self.states)
-
-            if self.model == 'sfjwm':
-                self.states = [st_r, st_ar, st_a2r, st_a2f, st_a2d, st_a2o, st_rs1, st_rsd, st_rs2]
-                model_kinetic = Kinetic(self.states)
-
-            self.models.append(model_kinetic)
-
+            self.models.append(compiled.with_stimulus(new_stimulus))
+
+
+'''
+kisiel_17 (not registered, incomplete sketch):
+
+if self.model == 'kisiel_17':
+    r_kon = Kinetic.State.Rate('kon', 43.2, new_stimulus)
+    r_2kon = Kinetic.State.Rate('2kon', 86.4, new_stimulus)
+    r_koff = Kinetic.State.Rate('koff', 1.82)
+    r_2koff = Kinetic.State.Rate('2koff', 3.64)
+    r_a0 = Kinetic.State.Rate('a0 ', 23.8)
+    r_r = Kinetic.State.Rate('r', 0.12)
+    r_b = Kinetic.State.Rate('b', 16.5)
+    r_a = Kinetic.State.Rate('a', 1.69)
+    r_y = Kinetic.State.Rate('y', 4.46)
+    r_g = Kinetic.State.Rate('g', 4.03)
+    r_s1f = Kinetic.State.Rate('s1f', 0.001)
+    r_s1b = Kinetic.State.Rate('s1b', 15)
+    r_s2f = Kinetic.State.Rate('s2f', 0.5)
+    r_s2b = Kinetic.State.Rate('s2b', 4.0)
+    r_sdf = Kinetic.State.Rate('sdf', 1.0)
+    r_sdb = Kinetic.State.Rate('sdb', 0.5)
+    r_0 = Kinetic.State.Rate('block', 0.00)
+
+if self.model == 'kisiel_17':
+
+    #                                       SO1     SO2     A1O1    A2O2    A2OSH1  A2OSH2  A2O     R       SC      A1R     A1F     A1D     A2R     A2DSH   A2F     A2D1    A2D2
+    st_so1    = Kinetic.State(0, 'SO1',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_so2    = Kinetic.State(0, 'SO2',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a1o1   = Kinetic.State(0, 'A1O1',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a1o2   = Kinetic.State(0, 'A1O2',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a2osh1 = Kinetic.State(0, 'A2OSH1', [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,],    0, 'open')
+    st_a2osh2 = Kinetic.State(0, 'A2OSH2', [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,],    0, 'open')
+    st_a2o    = Kinetic.State(0, 'A2O',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
+    st_r      = Kinetic.State(0, 'R',      [?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_sc     = Kinetic.State(0, 'SC',     [?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a1r    = Kinetic.State(0, 'A1R',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    ?,      r_0,    ?,      r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a1f    = Kinetic.State(0, 'A1F',    [r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a1d    = Kinetic.State(0, 'A1D',    [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a2r    = Kinetic.State(0, 'A2R',    [r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
+    st_a2dsh  = Kinetic.State(0, 'A2DSH',  [r_0,    r_0,    r_0,    r_0,    ?,      ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,],    0, 'open')
+    st_a2f    = Kinetic.State(0, 'A2F',    [r_0,    r_0,    r_0,    ?,      r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,    ?,       ?, ],    0, 'open')
+    st_a2d1   = Kinetic.State(0, 'A2D1',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
+    st_a2d2   = Kinetic.State(0, 'A2D2',   [r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    r_0,    ?,      r_0,    r_0,],    0, 'open')
+'''
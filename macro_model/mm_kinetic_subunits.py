@@ -0,0 +1,87 @@
+import itertools
+import logging as log
+import numpy as np
+from mm_kinetic import Kinetic
+from mm_kinetic import Stimulus
+
+
+# receptor mechanism generator #
+
+# subunits are described by their own states and transitions, receptor state is lumped by symmetry: only numbers of
+# subunits of each type in each subunit state are kept, transition rate of lumped state is number of subunits able to
+# make the transition times single subunit rate (named e.g. '2kon', as in hand written mechanisms)
+
+
+def receptor_states(subunits, stoichiometry):
+    """
+    enumerates symmetry lumped receptor states
+    :param subunits: dictionary (subunit type: {'states': [subunit states], 'transitions': [(from, to, rate name)]})
+    :param stoichiometry: dictionary (subunit type: number of subunits)
+    :return: list of receptor states, tuples (subunit types) of tuples (subunit state counts)
+    """
+    per_type = []
+    for subunit, number in stoichiometry.items():
+        names = subunits[subunit]['states']
+        per_type.append([tuple(combination.count(name) for name in names)
+                         for combination in itertools.combinations_with_replacement(names, number)])
+    return list(itertools.product(*per_type))
+
+
+def receptor_name(subunits, stoichiometry, state):
+    """
+    :param state: receptor state (see receptor_states)
+    :return: state name, e.g. 'R1A1.F3' (subunit types separated by dots)
+    """
+    return '.'.join(''.join('{}{}'.format(name, count) for name, count in zip(subunits[subunit]['states'], counts) if count)
+                    for subunit, counts in zip(stoichiometry, state))
+
+
+def compile_receptor(subunits, stoichiometry, rates, category, stimulated=(), sparse=False):
+    """
+    builds Kinetic object of receptor assembled from independent subunits, symmetry equivalent states are lumped
+    (e.g. 2 alpha / 3 beta subunits with 4 states each: 10 * 20 = 200 states instead of 4^5 = 1024), every subunit
+    starts in its first listed state
+    :param subunits: dictionary (subunit type: {'states': [subunit states], 'transitions': [(from, to, rate name)]})
+    :param stoichiometry: dictionary (subunit type: number of subunits), e.g. {'alpha': 2, 'beta': 3}
+    :param rates: dictionary (rate name: value) of single subunit rates
+    :param category: function taking dictionary (subunit type: dictionary (subunit state: count)), returning state
+                     category, e.g. 'open' if at least two subunits are flipped
+    :param stimulated: names of concentration dependant rates, unit stimulus placeholder (see Kinetic.with_stimulus)
+    :param sparse: sparse transition rate matrix storage
+    :return: Kinetic object
+    """
+    states = receptor_states(subunits, stoichiometry)
+    numbers = {state: no for no, state in enumerate(states)}
+    initial = tuple(tuple(number if idx == 0 else 0 for idx in range(len(subunits[subunit]['states'])))
+                    for subunit, number in stoichiometry.items())
+    log.info("### Receptor states: {} lumped ({} not lumped)".format(
+        len(states), int(np.prod([len(subunits[subunit]['states']) ** number for subunit, number in stoichiometry.items()]))))
+
+    placeholder = Stimulus.square(-np.inf, np.inf, 1.0)
+    multiples = {}
+
+    def rate(name, count):
+        if (name, count) not in multiples:
+            multiples[(name, count)] = Kinetic.State.Rate(name if count == 1 else '{}{}'.format(count, name),
+                                                          count * rates[name], placeholder if name in stimulated else False)
+        return multiples[(name, count)]
+
+    kinetic_states = []
+    for no, state in enumerate(states):
+        transitions = {}
+        for idx, (subunit, counts) in enumerate(zip(stoichiometry, state)):
+            names = subunits[subunit]['states']
+            for source, target, name in subunits[subunit]['transitions']:
+                count = counts[names.index(source)]
+                if not count:
+                    continue
+                moved = list(counts)
+                moved[names.index(source)] -= 1
+                moved[names.index(target)] += 1
+                transitions[numbers[state[:idx] + (tuple(moved),) + state[idx + 1:]]] = rate(name, count)
+
+        occupancy = {subunit: dict(zip(subunits[subunit]['states'], counts)) for subunit, counts in zip(stoichiometry, state)}
+        kinetic_states.append(Kinetic.State(no, receptor_name(subunits, stoichiometry, state), transitions,
+                                            1 if state == initial else 0, category(occupancy)))
+
+    return Kinetic(kinetic_states, sparse)
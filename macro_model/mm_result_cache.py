@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import logging as log
+
+VERSION = 2                                                                     # bump when solver numerics change
+ODE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ode_cache')
+
+# solver settings affecting results (per analyzer and solver), passed to solvers and hashed into cache key
+SOLVER_SETTINGS = {'mm_analyzer_ode': {'ode': {'samples': int(1e3), 'atol': 1e-4},
+                                       'ivp': {'method': 'LSODA', 'samples': int(1e3), 'rtol': 1e-6, 'atol': 1e-9},
+                                       'exp': {'samples': int(1e3)},
+                                       'batch': {'samples': int(1e3)}},
+                   'analyzer_single_ode': {'ode': {'samples': int(1e4), 'atol': 1e-3},
+                                           'exp': {'samples': int(1e4)}}}
+
+
+class ResultCache:
+
+    def __init__(self, path=ODE_CACHE, limit=512 * 2 ** 20):
+        """
+        content addressed cache of analyzer tables, one npz file per key, least recently used files are removed
+        above size limit
+        :param path: cache directory
+        :param limit: maximum total size of cache files [bytes]
+        """
+        self.path, self.limit = path, limit
+
+    @staticmethod
+    def key(models, p0, labels, t0, te, settings):
+        """
+        hashes compiled models (rate arrays, rate names, states, stimuli), starting conditions, concentrations,
+        time window and solver settings
+        :param models: list of Kinetic objects
+        :param p0: starting conditions
+        :param labels: agonist concentrations of models
+        :param t0: starting time
+        :param te: ending time
+        :param settings: solver settings (anything with stable repr: solver name, samples, tolerances, lumping)
+        :return: hexadecimal digest
+        """
+        digest = hashlib.sha256()
+        digest.update(repr(VERSION).encode())
+        for model in models:
+            arrays = [model.trm_c.row, model.trm_c.col, model.trm_c.data] if model.sparse else [model.trm_c]
+            for array in arrays + [model.trm_rows, model.trm_cols, model.trm_values, model.trm_index]:
+                digest.update(np.ascontiguousarray(array).tobytes())
+            names = model.trm_n if model.sparse else (model.trm_n,)
+            digest.update(repr([list(np.ravel(array)) for array in names]).encode())
+            digest.update(repr([(state.name, state.border, state.category) for state in model.states]).encode())
+            digest.update(repr(model.trm_stimuli).encode())
+        p0 = np.asarray(p0, dtype=float)
+        digest.update(repr(p0.shape).encode() + p0.tobytes())
+        digest.update(repr([float(label) for label in labels]).encode())
+        digest.update(repr((t0, te, settings)).encode())
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def load(self, key):
+        """
+        :param key: cache key
+        :return: dictionary (table name: data frame or list of data frames), None if not cached
+        """
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        os.utime(filename)                                                    # least recently used bookkeeping
+        tables = {}
+        with np.load(filename, allow_pickle=False) as stored:
+            for name in json.loads(str(stored['tables'])):
+                frames = [cache_frame(stored, '{}/{}'.format(name, idx)) for idx in range(int(stored[name + '/length']))]
+                tables[name] = frames if bool(stored[name + '/list']) else frames[0]
+        log.info("Results loaded from cache: {}".format(filename))
+        return tables
+
+    def save(self, key, tables):
+        """
+        stores tables columnar (values, index and column labels of every data frame), then enforces size limit
+        :param key: cache key
+        :param tables: dictionary (table name: data frame or list of data frames)
+        """
+        columns = {'tables': np.array(json.dumps(list(tables)))}
+        for name, frames in tables.items():
+            columns[name + '/list'] = np.array(isinstance(frames, list))
+            frames = frames if isinstance(frames, list) else [frames]
+            columns[name + '/length'] = np.array(len(frames))
+            for idx, frame in enumerate(frames):
+                prefix = '{}/{}'.format(name, idx)
+                columns[prefix + '/values'] = frame.values
+                columns[prefix + '/index'] = frame.index.values
+                columns[prefix + '/labels'] = np.array(json.dumps({'index': frame.index.name, 'columns': list(frame.columns)}))
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.filename(key)
+        temporary = filename + '.tmp.npz'
+        np.savez(temporary, **columns)
+        os.replace(temporary, filename)
+        log.info("Results stored in cache: {}".format(filename))
+        self.evict()
+
+    def evict(self):
+        """
+        removes least recently used files until total size is within limit
+        """
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.npz')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(name) for name in files)
+        for name in files[:-1]:
+            if total <= self.limit:
+                break
+            total -= os.path.getsize(name)
+            os.remove(name)
+            log.info("Removed from cache: {}".format(name))
+
+
+def cached_tables(cache, analyzer, solver, models, p0, labels, t0, te, belongs, compute):
+    """
+    analyzer tables through result cache, key covers models, starting conditions, concentrations, time window,
+    solver settings and category lumping
+    :param cache: ResultCache object, tables are computed every time if not given
+    :param analyzer: analyzer name (see SOLVER_SETTINGS)
+    :param solver: solver name
+    :param models: list of Kinetic objects
+    :param p0: starting conditions
+    :param labels: agonist concentrations of models
+    :param t0: starting time
+    :param te: ending time
+    :param belongs: dictionary (category: list of states)
+    :param compute: function computing tables on cache miss
+    :return: dictionary (table name: data frame or list of data frames)
+    """
+    if not cache:
+        return compute()
+    settings = (analyzer, solver, sorted(SOLVER_SETTINGS[analyzer][solver].items()), list(belongs.items()))
+    key = cache.key(models, p0, labels, t0, te, settings)
+    tables = cache.load(key)
+    if tables is None:
+        tables = compute()
+        cache.save(key, tables)
+    return tables
+
+
+def cache_frame(stored, prefix):
+    """
+    :param stored: opened npz file
+    :param prefix: data frame prefix
+    :return: data frame
+    """
+    labels = json.loads(str(stored[prefix + '/labels']))
+    return pd.DataFrame(data=stored[prefix + '/values'], index=pd.Index(stored[prefix + '/index'], name=labels['index']),
+                        columns=labels['columns'])
+
+
+if __name__ == '__main__':
+    # regression check: concentrations, starting conditions and every solver setting must change the key
+    from mm_kinetic_models import ModelBuilder
+    builder = ModelBuilder('jwm', [0.1, 1.0], 'pair')
+    other = ModelBuilder('jwm', [5., 50.], 'pair')
+    p0 = np.array(builder.states_ini_concentrations, dtype=float)
+    settings = ('mm_analyzer_ode', 'exp', [('samples', 1000)], list(builder.states_belongs.items()))
+    reference = ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 3000, settings)
+    variants = {'concentrations': ResultCache.key(other.models, p0, other.agonist_concentrations, 0, 3000, settings),
+                'p0': ResultCache.key(builder.models, np.roll(p0, 1), builder.agonist_concentrations, 0, 3000, settings),
+                'samples': ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 3000,
+                                           settings[:2] + ([('samples', 10000)],) + settings[3:]),
+                'tolerance': ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 3000,
+                                             settings[:2] + ([('samples', 1000), ('atol', 1e-9)],) + settings[3:]),
+                'lumping': ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 3000,
+                                           settings[:3] + ([(True, builder.states_names)],)),
+                'window': ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 1500, settings)}
+    assert reference == ResultCache.key(builder.models, p0, builder.agonist_concentrations, 0, 3000, settings)
+    for name, key in variants.items():
+        assert key != reference, "Cache key ignores {}".format(name)
+    print("Cache key check passed: {}".format(', '.join(variants)))
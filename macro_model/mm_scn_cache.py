@@ -0,0 +1,80 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import logging as log
+from dcpyps import dataset
+
+SCN_CACHE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scn_cache')  # shared with single_channel link
+
+
+def scn_key(filenames, conc, tres, tcrit):
+    """
+    :return: hash of SCN file contents, concentration, resolution and critical shut time
+    """
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as scn:
+            digest.update(hashlib.sha256(scn.read()).digest())
+    digest.update(repr((float(conc), float(tres), float(tcrit))).encode())
+    return digest.hexdigest()
+
+
+def scn_ingest(filenames, conc, tres, tcrit, path=SCN_CACHE):
+    """
+    ingestion cache of SCN files, dataset.SCRecord is built on first read only; cache file holds resolution-imposed
+    intervals, amplitudes and properties, burst intervals (flat, with burst offsets) and the pickled record
+    :param filenames: list of SCN file names
+    :param conc: concentration
+    :param tres: time resolution
+    :param tcrit: critical shut time
+    :param path: cache directory
+    :return: cache file name
+    """
+    filename = os.path.join(path, scn_key(filenames, conc, tres, tcrit) + '.npz')
+    if os.path.exists(filename):
+        return filename
+
+    rec = dataset.SCRecord(filenames, conc, tres, tcrit)
+    rec.record_type = 'recorded'
+    bursts = rec.bursts.intervals()
+    offsets = np.concatenate(([0], np.cumsum([len(burst) for burst in bursts]))).astype(int)
+    intervals = np.concatenate([np.asarray(burst, dtype=float) for burst in bursts]) if bursts else np.zeros(0)
+    try:
+        record = np.frombuffer(pickle.dumps(rec), dtype=np.uint8)
+    except (pickle.PicklingError, TypeError, AttributeError) as error:
+        log.warning("SCRecord not cached, rebuilt on every read: {}".format(error))
+        record = np.zeros(0, dtype=np.uint8)
+
+    os.makedirs(path, exist_ok=True)
+    temporary = filename + '.tmp.npz'
+    np.savez(temporary, rtint=np.asarray(rec.rtint, dtype=float), rampl=np.asarray(rec.rampl, dtype=float),
+             rprops=np.asarray(rec.rprops, dtype=int), intervals=intervals, offsets=offsets, record=record)
+    os.replace(temporary, filename)
+    log.info("SCN ingested: {} -> {}".format(filenames, filename))
+    return filename
+
+
+def scn_bursts(filenames, conc, tres, tcrit, path=SCN_CACHE):
+    """
+    burst intervals through ingestion cache (record is not unpickled)
+    :return: list of bursts (lists of intervals), as dataset.SCRecord.bursts.intervals()
+    """
+    with np.load(scn_ingest(filenames, conc, tres, tcrit, path)) as stored:
+        intervals, offsets = stored['intervals'], stored['offsets']
+    log.info("Bursts of {}: {} (tres: {} s, tcrit: {} s)".format(filenames, len(offsets) - 1, tres, tcrit))
+    return [intervals[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def scn_record(filenames, conc, tres, tcrit, path=SCN_CACHE):
+    """
+    single channel record through ingestion cache, for code needing the record itself (e.g. fitMLL.FittingSession)
+    :return: dataset.SCRecord object (record_type 'recorded')
+    """
+    with np.load(scn_ingest(filenames, conc, tres, tcrit, path)) as stored:
+        record = stored['record']
+    if len(record):
+        return pickle.loads(record.tobytes())
+    rec = dataset.SCRecord(filenames, conc, tres, tcrit)
+    rec.record_type = 'recorded'
+    return rec
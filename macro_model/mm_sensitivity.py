@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import scipy.linalg as lin
+import time as tm
+import logging as log
+
+
+class SolverSensitivity:
+
+    def __init__(self, model, p0, names, t0, te, rates=None, samples=int(1e3), stats=None):
+        """
+        forward sensitivity solver for piecewise constant stimuli, occupancies and their derivatives with respect
+        to rate constants are propagated together by block triangular matrix exponential:
+        expm([[Q, dQ/dk], [0, Q]] * t) = [[expm(Q * t), d expm(Q * t) / dk], [0, expm(Q * t)]]
+        :param model: Kinetic object (dense)
+        :param p0: starting conditions
+        :param names: names of states
+        :param t0: starting time
+        :param te: ending time
+        :param rates: list of rate names, all named rates of the model if not given ('block' excluded)
+        :param samples: number of output time points
+        :param stats: SolverStats object (telemetry), none collected if not given
+        """
+        self.model, self.p0, self.names, self.t0, self.te, self.samples = model, p0, names, t0, te, samples
+        self.stats = stats
+        self.rates = self.get_rates() if rates is None else list(rates)
+        self.tp, self.sensitivities = self.solve_sensitivity()
+
+    def get_rates(self):
+        """
+        :return: list of distinct rate names of the model
+        """
+        names = [name for name in dict.fromkeys(self.model.trm_n.ravel()) if name not in ('', 'block')]
+        return names
+
+    def trm_derivatives(self, levels):
+        """
+        derivatives of normalized transition rate matrix with respect to rates (Q is linear in every rate)
+        :param levels: stimulus values
+        :return: array (rates x states x states)
+        """
+        names_stimulus = self.model.trm_n[self.model.trm_rows, self.model.trm_cols]
+        mask_stimulus = np.zeros(self.model.trm_c.shape, dtype=bool)
+        mask_stimulus[self.model.trm_rows, self.model.trm_cols] = True
+
+        derivatives = []
+        for name in self.rates:
+            if not np.any(self.model.trm_n == name):
+                raise KeyError("Unknown rate: {}".format(name))
+            trm_c = ((self.model.trm_n == name) & ~mask_stimulus).astype(float)
+            trm_values = (names_stimulus == name).astype(float)
+            derivatives.append(self.model.trm_evaluate(levels, True, trm_c, trm_values))
+        return np.array(derivatives)
+
+    def augmented(self, levels):
+        """
+        block triangular generator of occupancies (first block) and sensitivities (next blocks), row vector form
+        :param levels: stimulus values
+        :return: array (states * (rates + 1) x states * (rates + 1))
+        """
+        n, m = len(self.p0), len(self.rates)
+        q = self.model.trm_evaluate(levels)
+        generator = np.kron(np.eye(m + 1), q)
+        for idx, derivative in enumerate(self.trm_derivatives(levels)):
+            generator[:n, (idx + 1) * n:(idx + 2) * n] = derivative
+        return generator
+
+    def solve_sensitivity(self):
+        """
+        propagator solver, output times as in SolverOde, propagators are computed once per stimulus segment
+        :return: pandas data frame (time + states), array of sensitivities (times x states x rates)
+        """
+        dt = (self.te - self.t0) / self.samples
+        t = self.t0 + dt * np.arange(1, self.samples + 1)
+        n, m = len(self.p0), len(self.rates)
+
+        self.model.trm_constant()
+        bounds = [self.t0] + self.model.trm_edges(self.t0, self.te) + [self.te]
+        y = np.zeros(n * (m + 1))
+        y[:n] = self.p0
+        result = np.zeros((self.samples, n * (m + 1)))
+
+        log.info("### Initiating sensitivity solver")
+        log.info("States: {} Rates: {} Segments: {}".format(n, m, len(bounds) - 1))
+        start_time = tm.time()
+        idx = 0
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            generator = self.augmented(self.model.trm_levels(0.5 * (start + end)))
+            if self.stats:
+                self.stats.count('segments')
+            last = np.searchsorted(t, end, side='right')
+            now = start
+            if last > idx:
+                y = np.dot(y, lin.expm(generator * (t[idx] - start)))
+                result[idx] = y
+                propagator = lin.expm(generator * dt)
+                for sample in range(idx + 1, last):
+                    y = np.dot(y, propagator)
+                    result[sample] = y
+                now, idx = t[last - 1], last
+            if end > now:
+                y = np.dot(y, lin.expm(generator * (end - now)))
+        if self.stats:
+            self.stats.add_time('propagation', tm.time() - start_time)
+            self.stats.peak('sensitivities', result.nbytes)
+        log.info("### Done sensitivity solver")
+
+        tp = pd.DataFrame(data=result[:, :n], index=pd.Index(t, name='time'), columns=self.names)
+        sensitivities = result[:, n:].reshape(self.samples, m, n).transpose(0, 2, 1)
+
+        return tp, sensitivities
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (time + states), array of sensitivities dP(t)/dk (times x states x rates),
+                 rates ordered as in self.rates
+        """
+        return self.tp, self.sensitivities
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import scipy.linalg as lin
+import logging as log
+
+
+class SolverBatch:
+
+    def __init__(self, models, p0, names, t0, te, labels=None, rates=None, samples=int(1e3)):
+        """
+        batched propagator solver, all models (e.g. concentrations) times all rate sets are advanced together
+        :param models: list of Kinetic objects sharing states (piecewise constant stimuli only)
+        :param p0: starting conditions
+        :param names: names of states
+        :param t0: starting time
+        :param te: ending time
+        :param labels: model labels (e.g. concentrations), model indexes if not given
+        :param rates: list of dictionaries (rate name: value) overriding model rates, model rates if not given
+        :param samples: number of output time points
+        """
+        self.models, self.p0, self.names, self.t0, self.te, self.samples = models, p0, names, t0, te, samples
+        self.labels = list(range(len(models))) if labels is None else list(labels)
+        self.rates = [{}] if rates is None else rates
+
+        for model in self.models:
+            model.trm_constant()
+        self.systems = [(model, model.trm_override(rates)) for model in self.models for rates in self.rates]
+        self.tp = self.solve_batch()
+
+    def trm_stack(self, t):
+        """
+        stacks transition rate matrices of all systems
+        :param t: time
+        :return: array (systems x states x states)
+        """
+        return np.array([model.trm_evaluate(model.trm_levels(t), True, *override) for model, override in self.systems])
+
+    @staticmethod
+    def step(p, q, dt):
+        """
+        advances all systems by constant stimulus period
+        :param p: occupancies (systems x states)
+        :param q: stacked transition rate matrices
+        :param dt: period length
+        :return: occupancies (systems x states)
+        """
+        return np.einsum('ks,kst->kt', p, lin.expm(q * dt))
+
+    def solve_batch(self):
+        """
+        propagator solver, output times as in SolverOde, propagators are computed once per stimulus segment
+        :return: pandas data frame (time + model/rates/state columns)
+        """
+        dt = (self.te - self.t0) / self.samples
+        t = self.t0 + dt * np.arange(1, self.samples + 1)
+
+        edges = sorted(set(edge for model in self.models for edge in model.trm_edges(self.t0, self.te)))
+        bounds = [self.t0] + edges + [self.te]
+
+        p = np.tile(np.array(self.p0, dtype=float), (len(self.systems), 1))
+        result = np.zeros((self.samples, len(self.systems), len(self.p0)))
+
+        log.info("### Initiating batch propagator solver")
+        log.info("Systems: {} Segments: {}".format(len(self.systems), len(bounds) - 1))
+        idx = 0
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            q = self.trm_stack(0.5 * (start + end))
+            last = np.searchsorted(t, end, side='right')
+            now = start
+            if last > idx:
+                p = self.step(p, q, t[idx] - start)
+                result[idx] = p
+                propagator = lin.expm(q * dt)
+                for sample in range(idx + 1, last):
+                    p = np.einsum('ks,kst->kt', p, propagator)
+                    result[sample] = p
+                now, idx = t[last - 1], last
+            if end > now:
+                p = self.step(p, q, end - now)
+        log.info("### Done batch propagator solver")
+
+        columns = pd.MultiIndex.from_tuples([(label, rates, name) for label in self.labels
+                                             for rates in range(len(self.rates)) for name in self.names],
+                                            names=['model', 'rates', 'state'])
+        tp = pd.DataFrame(data=result.reshape(self.samples, -1), index=pd.Index(t, name='time'), columns=columns)
+
+        return tp
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (time + model/rates/state columns)
+        """
+        return self.tp
+
+    def get_system(self, model, rates=0):
+        """
+        brings numeric results of single system
+        :param model: model index
+        :param rates: rate set index
+        :return: pandas data frame (time + states), as in SolverOde
+        """
+        tp = self.tp.loc[:, (self.labels[model], rates)].copy()
+        tp.columns = list(tp.columns)
+        return tp
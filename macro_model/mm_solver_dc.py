@@ -1,40 +1,216 @@
 import logging as log
 import numpy as np
+import pandas as pd
+import os
 import time
 import math
+import multiprocessing as mp
 from scipy.optimize import minimize
 from dcpyps import dcio
-from dcpyps import dataset
 from dcpyps import mechanism
 from dcpyps.sccalc import popen
 from dcprogs.likelihood import Log10Likelihood
+from mm_scn_cache import scn_bursts
 
 
-class fitterDC:
+SIMPLEX_ROUND = 50                                                              # iterations between simplex checkpoints
+LIKELIHOOD_KWARGS = {'nmax': 2, 'xtol': 1e-12, 'rtol': 1e-12, 'itermax': 100, 'lower_bound': -1e6, 'upper_bound': 0}
 
-    def __init__(self, mec_file_name, mec_model_num, fixed, scn_files, scn_tres, scn_tcrit, scn_conc):
 
-        # mechanism preparation
+def load_mechanism(mec_file_name, mec_model_num, fixed):
+    """
+    loads mechanism with fixed and constrained rates (shared by fitter and pool workers)
+    :param mec_file_name: mec file name
+    :param mec_model_num: model number within mec file
+    :param fixed: list of fixed rate names
+    :return: mec file version, mec list, number of models, mechanism
+    """
+    version, mec_list, mec_num = dcio.mec_get_list(mec_file_name)
+
+    mec = dcio.mec_load(mec_file_name, mec_list[0][mec_model_num])
+    for rate in mec.Rates:
+        if rate._get_name().strip() in fixed:
+            log.info('Fixing rate: {}'.format(rate._get_name()))
+            rate.fixed = True
+        else:
+            log.info('Not fixing rate: {}'.format(rate._get_name()))
+            rate.fixed = False
+
+    mec.Rates[14].is_constrained = True
+    mec.Rates[14].constrain_func = mechanism.constrain_rate_multiple
+    mec.Rates[14].constrain_args = [16, 2]
+
+    mec.Rates[17].is_constrained = True
+    mec.Rates[17].constrain_func = mechanism.constrain_rate_multiple
+    mec.Rates[17].constrain_args = [15, 2]
+
+    return version, mec_list, mec_num, mec
+
+
+# pool worker state: own mechanism copy and likelihood objects of all recording sets
+_worker = {}
+
+
+def likelihood_init(mec_file_name, mec_model_num, fixed, bursts, tres, tcrit, conc):
+    """
+    pool worker initializer, mechanism and likelihoods are built once per worker
+    """
+    mec = load_mechanism(mec_file_name, mec_model_num, fixed)[3]
+    _worker['mec'] = mec
+    _worker['conc'] = conc
+    _worker['likelihood'] = [Log10Likelihood(bur, mec.kA, tr, tc, **LIKELIHOOD_KWARGS) for bur, tr, tc in zip(bursts, tres, tcrit)]
+
+
+def likelihood_term(idx, x):
+    """
+    negative log-likelihood of single recording set (pool worker)
+    :param idx: recording set index
+    :param x: log of free rates
+    :return: negative natural log-likelihood
+    """
+    mec = _worker['mec']
+    mec.theta_unsqueeze(np.exp(x))
+    mec.set_eff('c', _worker['conc'][idx])
+    return -_worker['likelihood'][idx](mec.Q) * math.log(10)
+
+
+def likelihood_total(x):
+    """
+    negative log-likelihood of all recording sets (pool worker)
+    :param x: log of free rates
+    :return: negative natural log-likelihood
+    """
+    return sum(likelihood_term(idx, x) for idx in range(len(_worker['conc'])))
+
+
+def profile_branch(idx, values, x_start, function=likelihood_total):
+    """
+    profile likelihood of single rate in one direction, every point is warm-started from the previous one
+    :param idx: index of profiled rate in theta
+    :param values: log rate values, ordered outward from the optimum
+    :param x_start: log of free rates at the optimum
+    :param function: negative log-likelihood (pool worker likelihood if not given)
+    :return: list of negative log-likelihoods, one per value
+    """
+    profile = []
+    x = np.delete(x_start, idx)
+    for value in values:
+        if not len(x):
+            profile.append(function(np.array([value])))
+            continue
+        result = minimize(lambda y: function(np.insert(y, idx, value)), x, method='Nelder-Mead',
+                          options={'xatol': 1e-4, 'fatol': 1e-4, 'maxiter': 5000, 'maxfev': 10000})
+        x = result.x
+        profile.append(result.fun)
+    return profile
+
+
+def profile_bound(estimate, values, profile, minimum, threshold=3.84):
+    """
+    likelihood ratio bound, first point where 2 * (profile - minimum) exceeds chi-square quantile, interpolated
+    :param estimate: log rate at the optimum
+    :param values: log rate values, ordered outward from the optimum
+    :param profile: negative log-likelihoods at values
+    :param minimum: negative log-likelihood at the optimum
+    :param threshold: chi-square (1 degree of freedom) quantile, 3.84 for 95% interval
+    :return: log rate bound, nan if profile stays below threshold within the grid
+    """
+    values = np.concatenate(([estimate], values))
+    deviance = 2 * (np.concatenate(([minimum], profile)) - minimum)
+    crossed = np.nonzero(deviance > threshold)[0]
+    if not len(crossed):
+        return np.nan
+    k = crossed[0]
+    return values[k - 1] + (threshold - deviance[k - 1]) * (values[k] - values[k - 1]) / (deviance[k] - deviance[k - 1])
+
 
-        self.mec_file_name, self.mec_model_num = mec_file_name, mec_model_num
-        self.version, self.mec_list, self.mec_num = dcio.mec_get_list(self.mec_file_name)
+class CachedObjective:
 
-        self.mec = dcio.mec_load(self.mec_file_name, self.mec_list[0][self.mec_model_num])
-        for rate in self.mec.Rates:
-            if rate._get_name().strip() in fixed:
-                log.info('Fixing rate: {}'.format(rate._get_name()))
-                rate.fixed = True
-            else:
-                log.info('Not fixing rate: {}'.format(rate._get_name()))
-                rate.fixed = False
+    def __init__(self, function, checkpoint=None, every=50, limit=10000):
+        """
+        objective wrapper with exact-theta cache, evaluated points and current simplex are written to checkpoint
+        file periodically, cache keeps best points (and simplex vertices) when it exceeds limit
+        :param function: objective function
+        :param checkpoint: npz file name (no checkpoints if not given)
+        :param every: number of new evaluations between checkpoints
+        :param limit: maximum number of cached points
+        """
+        self.function, self.checkpoint, self.every, self.limit = function, checkpoint, every, limit
+        self.cache = {}
+        self.simplex = None
+        self.evaluations = 0
+        self.iterations = 0
 
-        self.mec.Rates[14].is_constrained = True
-        self.mec.Rates[14].constrain_func = mechanism.constrain_rate_multiple
-        self.mec.Rates[14].constrain_args = [16, 2]
+    def __call__(self, x, *args):
+        key = np.asarray(x, dtype=float).tobytes()
+        if key not in self.cache:
+            self.cache[key] = self.function(x)
+            self.evaluations += 1
+            if len(self.cache) > self.limit:
+                self.prune()
+            if self.checkpoint and self.evaluations % self.every == 0:
+                self.save()
+        return self.cache[key]
 
-        self.mec.Rates[17].is_constrained = True
-        self.mec.Rates[17].constrain_func = mechanism.constrain_rate_multiple
-        self.mec.Rates[17].constrain_args = [15, 2]
+    def best(self, number=1):
+        """
+        :param number: number of points
+        :return: array of best evaluated points (number x parameters), array of their values
+        """
+        keys = sorted(self.cache, key=self.cache.get)[:number]
+        return np.array([np.frombuffer(key) for key in keys]), np.array([self.cache[key] for key in keys])
+
+    def prune(self):
+        """
+        shrinks cache to best half of limit, vertices of current simplex are kept
+        """
+        keep = set(sorted(self.cache, key=self.cache.get)[:self.limit // 2])
+        if self.simplex is not None:
+            keep.update(np.asarray(vertex, dtype=float).tobytes() for vertex in self.simplex)
+        self.cache = {key: value for key, value in self.cache.items() if key in keep}
+
+    def save(self):
+        """
+        writes evaluated points, best point, simplex and counters, atomically
+        """
+        thetas, values = self.best(len(self.cache))
+        simplex = np.zeros((0, thetas.shape[1])) if self.simplex is None else self.simplex
+        temporary = self.checkpoint + '.tmp.npz'
+        np.savez(temporary, thetas=thetas, values=values, best=thetas[0], simplex=simplex,
+                 evaluations=self.evaluations, iterations=self.iterations)
+        os.replace(temporary, self.checkpoint)
+        log.info("Checkpoint: {} evaluations, best {}".format(self.evaluations, values[0]))
+
+    def resume(self):
+        """
+        reads checkpoint file, if present, into cache
+        :return: best point and simplex of optimizer (None if no checkpoint or no simplex saved yet)
+        """
+        if not (self.checkpoint and os.path.exists(self.checkpoint)):
+            return None, None
+        with np.load(self.checkpoint) as stored:
+            for theta, value in zip(stored['thetas'], stored['values']):
+                self.cache[np.asarray(theta, dtype=float).tobytes()] = value
+            self.evaluations, self.iterations = int(stored['evaluations']), int(stored['iterations'])
+            best = stored['best']
+            self.simplex = stored['simplex'] if len(stored['simplex']) else None
+        log.info("Resumed from checkpoint: {} evaluations, {} iterations".format(self.evaluations, self.iterations))
+        return best, self.simplex
+
+
+class fitterDC:
+
+    def __init__(self, mec_file_name, mec_model_num, fixed, scn_files, scn_tres, scn_tcrit, scn_conc, workers=1):
+        """
+        :param workers: number of worker processes evaluating per-concentration likelihoods (1 evaluates them in
+                        sequence, pool is worth it with several recording sets, up to one worker per set)
+        """
+
+        # mechanism preparation
+
+        self.mec_file_name, self.mec_model_num, self.fixed = mec_file_name, mec_model_num, fixed
+        self.version, self.mec_list, self.mec_num, self.mec = load_mechanism(self.mec_file_name, self.mec_model_num, self.fixed)
+        self.workers = workers
 
         self.theta = np.log(self.mec.theta())
 
@@ -46,83 +222,132 @@ class fitterDC:
         # data preparation
 
         self.scn_files, self.scn_tres, self.scn_tcrit, self.scn_conc = scn_files, scn_tres, scn_tcrit, scn_conc
-        self.recs = []
-        self.bursts = []
-
-        for sfs, cn, tr, tc in zip(self.scn_files, self.scn_conc, self.scn_tres, self.scn_tcrit):
-            rec = dataset.SCRecord(sfs, cn, tr, tc)
-            rec.record_type = 'recorded'
-            self.recs.append(rec)
-            self.bursts.append(rec.bursts.intervals())
-            log.info(rec)
+        self.bursts = [scn_bursts(sfs, cn, tr, tc)
+                       for sfs, cn, tr, tc in zip(self.scn_files, self.scn_conc, self.scn_tres, self.scn_tcrit)]
 
         log.info("Reading files: {} with t_res: {} s, t_crit {} s and concentrations: {} M".format(self.scn_files, self.scn_tres, self.scn_tcrit, self.scn_conc))
 
-    def optimize_rates(self):
-
-        kwargs = {'nmax': 2, 'xtol': 1e-12, 'rtol': 1e-12, 'itermax': 100, 'lower_bound': -1e6, 'upper_bound': 0}
+    def optimize_rates(self, checkpoint=None):
+        """
+        :param checkpoint: npz file name, optimizer state is saved there and fit resumes from it if present
+        """
 
-        likelihood = []
+        initargs = (self.mec_file_name, self.mec_model_num, self.fixed, self.bursts, self.scn_tres, self.scn_tcrit, self.scn_conc)
 
-        for rec, bur in zip(self.recs, self.bursts):
-            likelihood.append(Log10Likelihood(bur, self.mec.kA, rec.tres, rec.tcrit, **kwargs))
+        if self.workers > 1:
+            pool = mp.Pool(self.workers, initializer=likelihood_init, initargs=initargs)
+        else:
+            pool = None
+            likelihood_init(*initargs)
 
         def dcprogslik(x, args=None):
-            self.mec.theta_unsqueeze(np.exp(x))
-            lik = 0
-            for idx, con in enumerate(self.scn_conc):
-                self.mec.set_eff('c', con)
-                lik += -likelihood[idx](self.mec.Q) * math.log(10)
-            return lik
+            if pool:
+                return sum(pool.starmap(likelihood_term, [(idx, x) for idx in range(len(self.scn_conc))]))
+            return sum(likelihood_term(idx, x) for idx in range(len(self.scn_conc)))
 
-        self.iternum = 0
+        objective = CachedObjective(dcprogslik, checkpoint)
+        best, simplex = objective.resume()
+        if best is not None:
+            self.theta = best
 
         def printiter(theta):
-            self.iternum += 1
-            lik = dcprogslik(theta)
-            log.info("iteration # {0:d}; log-lik = {1:.6f}".format(self.iternum, -lik))
+            objective.iterations += 1
+            lik = objective(theta)
+            log.info("iteration # {0:d}; log-lik = {1:.6f}".format(objective.iterations, -lik))
             log.info(np.exp(theta))
 
-        lik = dcprogslik(self.theta)
-        log.info("\nStarting likelihood (DCprogs)= {0:.6f}".format(-lik))
-        start = time.clock()
-        success = False
+        try:
+            lik = objective(self.theta)
+            log.info("\nStarting likelihood (DCprogs)= {0:.6f}".format(-lik))
+            start = time.perf_counter()
+            iterations = 0
 
-        while not success:
-            result = minimize(dcprogslik, self.theta, method='Nelder-Mead', callback=printiter, options={'xtol':1e-4, 'ftol':1e-4, 'maxiter': 5000, 'maxfev': 10000, 'disp': True})
-            if result.success:
-                success = True
-            else:
-                self.theta = result.x
+            # simplex runs in rounds continued from the final simplex of previous round (Nelder-Mead state), so the
+            # checkpoint holds the actual simplex; fresh start from best point after 5000 iterations without success
+            while True:
+                options = {'xatol': 1e-4, 'fatol': 1e-4, 'maxiter': SIMPLEX_ROUND, 'maxfev': 10000, 'initial_simplex': simplex}
+                result = minimize(objective, self.theta, method='Nelder-Mead', callback=printiter, options=options)
+                self.theta, iterations = result.x, iterations + result.nit
+                simplex = result.final_simplex[0] if iterations < 5000 and result.status == 2 else None
+                iterations = iterations if simplex is not None else 0
+                objective.simplex = simplex
+                if checkpoint:
+                    objective.save()
+                if result.success:
+                    break
 
-        end = time.clock()
-        log.info('time in simplex='.format(end - start))
+            end = time.perf_counter()
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        log.info('time in simplex={}'.format(end - start))
         log.info('\n\nresult=')
         log.info(result)
 
         log.info('\n Final log-likelihood = {0:.6f}'.format(-result.fun))
-        log.info('\n Number of iterations = {0:d}'.format(result.nit))
-        log.info('\n Number of evaluations = {0:d}'.format(result.nfev))
+        log.info('\n Number of iterations = {0:d}'.format(objective.iterations))
+        log.info('\n Number of evaluations = {0:d}'.format(objective.evaluations))
         self.mec.theta_unsqueeze(np.exp(result.x))
+        self.theta, self.minimum = result.x, result.fun
         log.info("\n Final rate constants: {}".format(self.mec))
         log.info('Dose response: {}'.format(popen.printout(self.mec, 0.000065)))
 
-log.basicConfig(filename='mm_dc.log', filemode='w', format='%(message)s', level=log.DEBUG)
-fitter = fitterDC('magda.mec', 0,
-                  [],
-                  [['121015C8.SCN', '12101591.SCN', '12101592.SCN', '13101511.SCN', '13101521.SCN', '13101531.SCN'],
-                   ['103161K1.SCN', '103161K2.SCN', '103161S1.SCN', '103161S2.SCN', '103162K1.SCN'], #, '103162S1.SCN', '103162S2.SCN'],
-                   ['16715151.SCN', '16715152.SCN'],
-                   ['18915151.SCN', '18915152.SCN', '18915153.SCN', '18915154.SCN', '18915155.SCN', '18915156.SCN']],
-                  [0.000065, 0.000065, 0.000065, 0.000065],
-                  [0.0105, 0.007, 0.005, 0.006],
-                  [10e-3, 10e-6, 1e-6, 0.1e-6])
-
-'''
-fitter = fitterDC('magda.mec', 0,
-                  ['alfa1', 'alfa2', 'alfa3', 'alfa4', 'alfa5', 'beta1', 'beta2', 'beta3', 'beta4', 'beta5', 'k on', 'k off', 'd1', 'r1', 'd2', 'r2', 'd4', 'r4'],
-                  [['121015C8.SCN']],
-                  [0.000065], [0.0105], [10e-3])
-'''
-
-fitter.optimize_rates()
+    def profile_rates(self, span=math.log(10), points=10, threshold=3.84):
+        """
+        profile likelihood intervals of free rates around the optimum (run after optimize_rates), every rate is fixed
+        on a grid and the others are re-optimized, both directions of every rate run in parallel
+        :param span: grid half width, natural log units (one decade by default)
+        :param points: grid points per direction
+        :param threshold: chi-square (1 degree of freedom) quantile, 3.84 for 95% interval
+        :return: pandas data frame (rate + estimate, lower and upper bounds), nan bound if not reached within grid
+        """
+        initargs = (self.mec_file_name, self.mec_model_num, self.fixed, self.bursts, self.scn_tres, self.scn_tcrit, self.scn_conc)
+        steps = span * np.arange(1, points + 1) / points
+        tasks = [(idx, self.theta[idx] + direction * steps, self.theta) for idx in range(len(self.theta)) for direction in (-1, 1)]
+
+        log.info("### Profile likelihood: {} rates, {} points per direction".format(len(self.theta), points))
+        start = time.time()
+        if self.workers > 1:
+            with mp.Pool(self.workers, initializer=likelihood_init, initargs=initargs) as pool:
+                minimum = pool.apply(likelihood_total, (self.theta,))
+                profiles = pool.starmap(profile_branch, tasks)
+        else:
+            likelihood_init(*initargs)
+            minimum = likelihood_total(self.theta)
+            profiles = [profile_branch(*task) for task in tasks]
+        log.info("--- %s seconds ---" % (time.time() - start))
+
+        names = [rate.name for rate in self.mec.Rates if not rate.fixed and not rate.is_constrained]
+        if len(names) != len(self.theta):
+            names = list(range(len(self.theta)))
+        self.profiles = {name: (tasks[2 * idx][1][::-1].tolist() + [self.theta[idx]] + tasks[2 * idx + 1][1].tolist(),
+                                profiles[2 * idx][::-1] + [minimum] + profiles[2 * idx + 1])
+                         for idx, name in enumerate(names)}
+
+        intervals = pd.DataFrame({'rate': names, 'estimate': np.exp(self.theta),
+                                  'lower': [np.exp(profile_bound(self.theta[idx], tasks[2 * idx][1], profiles[2 * idx], minimum, threshold)) for idx in range(len(names))],
+                                  'upper': [np.exp(profile_bound(self.theta[idx], tasks[2 * idx + 1][1], profiles[2 * idx + 1], minimum, threshold)) for idx in range(len(names))]})
+        log.info("Likelihood ratio intervals: \n{}".format(intervals))
+        return intervals
+
+if __name__ == '__main__':
+    log.basicConfig(filename='mm_dc.log', filemode='w', format='%(message)s', level=log.DEBUG)
+    fitter = fitterDC('magda.mec', 0,
+                      [],
+                      [['121015C8.SCN', '12101591.SCN', '12101592.SCN', '13101511.SCN', '13101521.SCN', '13101531.SCN'],
+                       ['103161K1.SCN', '103161K2.SCN', '103161S1.SCN', '103161S2.SCN', '103162K1.SCN'], #, '103162S1.SCN', '103162S2.SCN'],
+                       ['16715151.SCN', '16715152.SCN'],
+                       ['18915151.SCN', '18915152.SCN', '18915153.SCN', '18915154.SCN', '18915155.SCN', '18915156.SCN']],
+                      [0.000065, 0.000065, 0.000065, 0.000065],
+                      [0.0105, 0.007, 0.005, 0.006],
+                      [10e-3, 10e-6, 1e-6, 0.1e-6])
+
+    '''
+    fitter = fitterDC('magda.mec', 0,
+                      ['alfa1', 'alfa2', 'alfa3', 'alfa4', 'alfa5', 'beta1', 'beta2', 'beta3', 'beta4', 'beta5', 'k on', 'k off', 'd1', 'r1', 'd2', 'r2', 'd4', 'r4'],
+                      [['121015C8.SCN']],
+                      [0.000065], [0.0105], [10e-3])
+    '''
+
+    fitter.optimize_rates()
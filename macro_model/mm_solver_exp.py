@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import scipy.linalg as lin
+import scipy.sparse.linalg as spl
+import time as tm
+import logging as log
+
+
+class SolverExp:
+
+    def __init__(self, model, p0, names, t0, te, samples=int(1e3), stats=None):
+        """
+        exact propagator solver for piecewise constant stimuli, sparse models are propagated by
+        Krylov-type action of matrix exponential (expm_multiply), no decomposition is formed
+        :param model: Kinetic object
+        :param p0: starting conditions
+        :param names: names of states
+        :param t0: starting time
+        :param te: ending time
+        :param samples: number of output time points
+        :param stats: SolverStats object (telemetry), none collected if not given
+        """
+        self.model, self.p0, self.names, self.t0, self.te, self.samples = model, p0, names, t0, te, samples
+        self.stats = stats
+        self.decompositions = {}
+        self.tp = self.solve_exp()
+
+    def solve_exp(self):
+        """
+        propagator solver, output times as in SolverOde
+        :return: pandas data frame (time + states)
+        """
+        dt = (self.te - self.t0) / self.samples
+        t = self.t0 + dt * np.arange(1, self.samples + 1)
+
+        log.info("### Initiating propagator solver")
+        start_time = tm.time()
+        p = self.propagate(t)
+        if self.stats:
+            self.stats.add_time('propagation', tm.time() - start_time)
+            self.stats.peak('occupancies', p.nbytes)
+        log.info("### Done propagator solver")
+
+        tp = pd.DataFrame(data=p, index=pd.Index(t, name='time'), columns=self.names)
+
+        return tp
+
+    def propagate(self, t):
+        """
+        propagates starting conditions segment by segment, stimulus is constant within each segment
+        :param t: sorted array of output times
+        :return: array of probabilities (times x states)
+        """
+        self.model.trm_constant()
+        bounds = [self.t0] + self.model.trm_edges(self.t0, self.te) + [max(self.te, t[-1])]
+        segment = np.clip(np.searchsorted(bounds, t, side='left') - 1, 0, len(bounds) - 2)
+
+        p = np.zeros((len(t), len(self.p0)))
+        p_start = np.array(self.p0, dtype=float)
+
+        for idx, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            levels = self.model.trm_levels(0.5 * (start + end))
+            log.info("Segment: {} ms to {} ms Stimuli: {}".format(start, end, levels))
+            if self.stats:
+                self.stats.count('segments')
+            inside = segment == idx
+            if inside.any():
+                p[inside] = self.segment(levels, p_start, t[inside] - start)
+            p_start = self.segment(levels, p_start, np.array([end - start]))[0]
+
+        return p
+
+    def segment(self, levels, p, tau):
+        """
+        occupancies after constant stimulus periods: p * expm(Q * tau)
+        :param levels: stimulus values within segment
+        :param p: occupancies at segment start
+        :param tau: array of times since segment start
+        :return: array of probabilities (times x states)
+        """
+        if self.model.sparse:
+            return self.segment_sparse(levels, p, tau)
+
+        key = levels.tobytes()
+        if key not in self.decompositions:
+            if self.stats:
+                self.stats.count('decompositions')
+            self.decompositions[key] = self.decompose(self.model.trm_evaluate(levels))
+        q, w, v, vi = self.decompositions[key]
+
+        if w is None:
+            return np.dot(p, lin.expm(q * tau[:, np.newaxis, np.newaxis]))
+        return np.real(np.dot(np.dot(p, v) * np.exp(np.outer(tau, w)), vi))
+
+    def segment_sparse(self, levels, p, tau):
+        """
+        occupancies after constant stimulus periods for sparse models: expm(Q^T * tau) * p
+        :param levels: stimulus values within segment
+        :param p: occupancies at segment start
+        :param tau: array of times since segment start
+        :return: array of probabilities (times x states)
+        """
+        key = levels.tobytes()
+        if key not in self.decompositions:
+            if self.stats:
+                self.stats.count('decompositions')
+            self.decompositions[key] = self.model.trm_evaluate(levels).T.tocsr()
+        q = self.decompositions[key]
+
+        if len(tau) == 1:
+            return spl.expm_multiply(q * tau[0], p)[np.newaxis, :]
+        if np.allclose(np.diff(tau), tau[1] - tau[0]):
+            return spl.expm_multiply(q, p, start=tau[0], stop=tau[-1], num=len(tau), endpoint=True)
+        return np.array([spl.expm_multiply(q * step, p) for step in tau])
+
+    @staticmethod
+    def decompose(q):
+        """
+        eigendecomposition Q = V * diag(w) * V^-1, skipped for ill-conditioned eigenvectors
+        :param q: normalized transition rate matrix
+        :return: matrix, eigenvalues, eigenvectors, inverted eigenvectors (None if skipped)
+        """
+        w, v = np.linalg.eig(q)
+        if np.linalg.cond(v) > 1e8:
+            log.info("Ill-conditioned eigenvectors, falling back to matrix exponential")
+            return q, None, None, None
+        return q, w, v, np.linalg.inv(v)
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (time + states)
+        """
+        return self.tp
@@ -1,28 +1,37 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 import time as tm
-import numexpr as ne
+import bisect
+import concurrent.futures as cf
+import scipy.linalg as lin
 import logging as log
+from mm_telemetry import SolverStats
 
 
 
 class SolverGlp:
 
-    def __init__(self,  model, P0, p, t0, te, suspend, opsh):
+    def __init__(self,  model, P0, p, t0, te, opsh, stats=None, tcrit=None, seed=None, workers=1):
         """
         Monte Carlo Gillespie solver
         :param model:
-        :param P0: starting conditions
+        :param P0: starting conditions (one-hot row, first row taken)
         :param p: particle number
         :param t0: starting time
         :param te: ending time
-        :param suspend:
         :param opsh: list of open/shut states lists
+        :param stats: SolverStats object (telemetry), none collected if not given
+        :param tcrit: critical shut time separating bursts, no burst analysis if not given
+        :param seed: random seed (numpy SeedSequence entropy), fresh entropy if not given
+        :param workers: number of worker processes
         """
-        self.model, self.A, self.P0, self.t0, self.te, self.suspend, self.opsh = model, model.trm, P0, t0, te, suspend, opsh
+        self.model, self.A, self.P0, self.t0, self.te, self.opsh = model, model.trm, P0, t0, te, opsh
         self.parno = p
         self.stano = len(P0[0])
+        self.stats = stats
+        self.tcrit = tcrit
+        self.seed, self.workers = seed, workers
+        self.bursts = None
         log.info("### Initiating Gillespie Monte Carlo Solver")
         log.info("Particles: {}, States: {}".format(self.parno, self.stano))
         log.info("Initial concentrations: \n {}".format(self.P0))
@@ -30,192 +39,398 @@ class SolverGlp:
 
         start_time = tm.time()
         self.allP, self.allT = self.solve_glp()
-        log.info("--- %s seconds ---" % (tm.time() - start_time))
+        self.log_stage('gillespie', start_time)
         start_time = tm.time()
         self.mcP, self.mcT = self.get_cumulative()
-        log.info("--- %s seconds ---" % (tm.time() - start_time))
+        self.log_stage('cumulative', start_time)
         start_time = tm.time()
         self.occupations, self.opsh_occupations = self.get_distributions()
-        log.info("--- %s seconds ---" % (tm.time() - start_time))
-
+        self.log_stage('distributions', start_time)
 
-    def solve_glp(self):
+    def log_stage(self, name, start_time):
         """
-        Monte Carlo Gillespie solver
-        :return: array of probabilities, array of times
+        logs and collects stage wall time
+        :param name: stage name
+        :param start_time: stage start time
         """
+        elapsed = tm.time() - start_time
+        log.info("--- %s seconds ---" % elapsed)
+        if self.stats:
+            self.stats.add_time(name, elapsed)
 
-        allP = []
-        allT = []
 
-        for particle in range(self.parno):
-
-            P = np.array(self.P0)
-            T = np.array([self.t0])
-
-            # P = np.zeros((1, self.stano))
-            # T = np.zeros(1)
-            # P[0, :] = self.P0[0]
-            # T[0] = self.t0
-
-            log.info("### Gillespie iteration begins!")
-            initial = np.where(self.P0 > 0)[0]
-            log.info("Initial state: {}".format(self.model.states[initial].name))
-
-            step = 0
-            start_time = tm.time()
-
-            while T[step] < self.te:
-                current = np.where(P[step] > 0)
-                current_rate = self.A(T[step])[current][0]
-                current_rate_sum = ne.evaluate('sum(current_rate)')
-
-                log.info("#Step: {}, time: {}".format(step, T[step]))
-                log.info("Step state: {}".format(P[step]))
-                log.info("Step rates: {}".format(current_rate))
-                # log.info(self.A(T[step]))
-
-                if current_rate_sum == 0:
-                    log.info("Zero transition rate, staying in previous state")
-                    P = np.append(P, [P[step]], axis=0)
-                    # dt = 0.01
-                    for period in self.suspend:
-                        log.info("Check current time {} is in period {}".format(T[step], period))
-                        if period[0] <= T[step] < period[1]:
-                            log.info("End of suspend period: {}".format(period[1]))
-                            dt = period[1] - T[step]
-                else:
-                    new = np.zeros(self.stano)
-                    new_state = self.get_uni(current_rate)
-                    log.info("Non zero transition rate, changing to state {}".format(new_state))
-                    new[new_state] = 1.0
-                    P = np.append(P, [new], axis=0)
-                    dt = self.get_exp(current_rate)
-
-                log.info("Step occupancy time: {}".format(dt))
-
-                T = np.append(T, np.array([T[-1] + dt]))
-                step += 1
-
-            else:
-                log.info("### Gillespie iteration ends!")
-                log.info("Final time {} achieved after {} steps".format(self.te, step))
+    def get_epochs(self):
+        """
+        builds rate tables for every stimulus epoch (period between stimulus discontinuities), tables are
+        computed once per distinct stimulus level
+        :return: epoch start times, cumulative jump probabilities (epoch x state x state), total exit rates (epoch x state)
+        """
+        self.model.trm_constant()
+        edges = [self.t0] + self.model.trm_edges(self.t0, self.te)
+        bounds = edges + [self.te]
+        tables = {}
+        cumulative, totals = [], []
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            levels = self.model.trm_levels(0.5 * (start + end))
+            key = levels.tobytes()
+            if key not in tables:
+                rates = self.model.trm_evaluate(levels, normalize=False)
+                rates[self.model.trm_diag] = 0.
+                total = np.sum(rates, axis=1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    cumul = np.where(total[:, np.newaxis] > 0, np.cumsum(rates, axis=1) / total[:, np.newaxis], 0.)
+                cumul[:, -1] = np.where(total > 0, 1., 0.)                          # guard against rounding
+                tables[key] = (cumul.tolist(), total.tolist())
+                log.info("Epoch rate table for stimuli: {} \n{}".format(levels, rates))
+            cumulative.append(tables[key][0])
+            totals.append(tables[key][1])
+
+        return edges, cumulative, totals
 
-            allP.append(P)
-            allT.append(T)
+    def solve_glp(self):
+        """
+        Monte Carlo Gillespie solver, every particle draws from its own random substream, so results depend on
+        seed only, not on number of workers
+        :return: list (particles) of state index arrays, list (particles) of jump time arrays
+        """
 
-            log.info("--- %s seconds ---" % (tm.time() - start_time))
+        edges, cumulative, totals = self.get_epochs()
+        initial = int(np.argmax(self.P0[0]))
+        log.info("Initial state: {}".format(self.model.states_names[initial]))
+
+        sequence = np.random.SeedSequence(self.seed)
+        log.info("Seed entropy: {}".format(sequence.entropy))
+        streams = sequence.spawn(self.parno)
+        tables = (initial, self.t0, self.te, edges, cumulative, totals)
+
+        if self.workers > 1:
+            chunks = [streams[idx::self.workers] for idx in range(self.workers)]
+            telemetry = [SolverStats(self.stats.trace_every) if self.stats else None for _ in chunks]
+            with cf.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(glp_worker, [tables] * self.workers, chunks, telemetry))
+            trajectories = [None] * self.parno
+            for idx, (result, stats) in enumerate(results):
+                trajectories[idx::self.workers] = result
+                if self.stats:
+                    self.stats.merge(stats)
+        else:
+            trajectories = glp_particles(tables, streams, self.stats)
+
+        allP = [P for P, T in trajectories]
+        allT = [T for P, T in trajectories]
+        log.info("Particles: {} steps: {}".format(self.parno, sum(len(T) - 1 for T in allT)))
+        if self.stats:
+            self.stats.peak('trajectory', max(P.nbytes + T.nbytes for P, T in trajectories))
 
         return allP, allT
 
-    def get_cumulative(self):
+    def get_cumulative(self, samples=10000):
         """
-
-        :return:
+        ensemble averaged occupancies, state occupied by each particle at each sample time is found by
+        binary search of particle jump times
+        :param samples: number of sample times
+        :return: array of probabilities (samples x states), array of sample times
         """
         log.info("###Cumulative analysis begins!")
 
-        samples = 10000
-
         sampleT = np.linspace(self.t0, self.te, samples)
-        sampleP = np.array([np.zeros(self.stano) for i in range(samples)])
-        previousP = np.array([(np.zeros(self.stano)) for i in range(self.parno)])
-
-        for frame, f0 in enumerate(sampleT):
-
-            # abort at last frame
-            if frame == len(sampleT) - 1:
-                break
-            f1 = sampleT[frame+1]
-
-            log.info("Frame:{} time {} ms to {} ms".format(frame, f0, f1))
+        frames = np.arange(samples) * self.stano
+        sampleP = np.zeros(samples * self.stano)
 
-            # for each particle
-            for particle in range(self.parno):
-                single_sampleP = np.zeros(self.stano)
-                indexes = np.where(np.logical_and(self.allT[particle] >= f0, self.allT[particle] < f1))
-                times = self.allT[particle][indexes]
-                states = self.allP[particle][indexes]
-                if ne.evaluate("sum(states)") > 0:
-                    log.info("Particle: {} Timestep: {} States: {}".format(particle, times, states))
-
-                for state in states:
-                    single_sampleP += state
-
-                if np.sum(single_sampleP) == 0.:
-                    single_sampleP = previousP[particle]
-                previousP[particle] = single_sampleP
-
-                sampleP[frame] += single_sampleP
+        for particle in range(self.parno):
+            occupied = np.searchsorted(self.allT[particle], sampleT, side='right') - 1
+            sampleP += np.bincount(frames + self.allP[particle][occupied], minlength=samples * self.stano)
 
         log.info("###Cumulative analysis ends!")
-        sum_sampleP = sampleP.sum(axis=1)
-        norm_sampleP = sampleP / sum_sampleP[:, np.newaxis]
+        sampleP = sampleP.reshape(samples, self.stano)
+        norm_sampleP = sampleP / sampleP.sum(axis=1)[:, np.newaxis]
         return norm_sampleP, sampleT
 
-    def get_distributions(self):
-        # TODO: add array to store occupancy times of each state
-        # TODO: add array to store cumulative times of each shut and open period
-        # TODO: plot histograms of all
-
+    @staticmethod
+    def get_runs(P, T):
+        """
+        run-length encoding of a trajectory, consecutive dwells with equal value are merged
+        :param P: state (or category) index array
+        :param T: jump time array (last entry closes last dwell)
+        :return: run values, run start times, run end times
+        """
+        starts = np.concatenate(([0], np.flatnonzero(P[1:-1] != P[:-2]) + 1))
+        ends = np.concatenate((starts[1:], [len(P) - 1]))
+        return P[starts], T[starts], T[ends]
 
+    def get_distributions(self):
+        """
+        dwell time analysis: occupancy times of each state, open and shut periods (consecutive open or shut
+        states merged) and bursts of openings separated by shut periods shorter than tcrit
+        :return: dictionary (state: dwell times), dictionary (open/shut: period lengths)
+        """
         log.info("###Distribution analysis begins!")
 
         occupations = {state: [] for state in range(self.stano)}
         occupations_oc = {'open': [], 'shut': []}
-        for particle, particleP in enumerate(self.allP):
-            log.info("Particle: {}".format(particle))
-            traj = len(self.allT[particle])
-            for step, stepP in enumerate(particleP):
-                if step == traj - 1:
-                    break
-                state = np.where(stepP > 0)[0][0]
-                time = self.allT[particle][step+1] - self.allT[particle][step]  # direct store of occupancy times?
-                log.info("State: {}, occupancy time: {}".format(state, time))
-                if state in self.opsh[0]:
-                    occupations_oc['open'].append(time)
-                elif state in self.opsh[1]:
-                    occupations_oc['shut'].append(time)
-                occupations[state].append(time)
+        bursts = {'length': [], 'openings': [], 'open': []}
+        category = np.full(self.stano, -1)
+        category[list(self.opsh[0])] = 1
+        category[list(self.opsh[1])] = 0
+
+        for particleP, particleT in zip(self.allP, self.allT):
+            if len(particleP) < 2:
+                continue
+
+            states, starts, ends = self.get_runs(particleP, particleT)
+            for state in range(self.stano):
+                occupations[state].append((ends - starts)[states == state])
+
+            categories, starts, ends = self.get_runs(category[particleP], particleT)
+            occupations_oc['open'].append((ends - starts)[categories == 1])
+            occupations_oc['shut'].append((ends - starts)[categories == 0])
+
+            if self.tcrit is not None:
+                opened, starts, ends = self.get_runs(category[particleP] == 1, particleT)
+                starts, ends = starts[opened], ends[opened]
+                if len(starts):
+                    first = np.flatnonzero(np.concatenate(([True], starts[1:] - ends[:-1] >= self.tcrit)))
+                    last = np.concatenate((first[1:] - 1, [len(starts) - 1]))
+                    bursts['length'].append(ends[last] - starts[first])
+                    bursts['openings'].append(np.diff(np.concatenate((first, [len(starts)]))))
+                    bursts['open'].append(np.add.reduceat(ends - starts, first))
+
+        occupations = {state: np.concatenate(times) if times else np.zeros(0) for state, times in occupations.items()}
+        occupations_oc = {period: np.concatenate(times) if times else np.zeros(0) for period, times in occupations_oc.items()}
+        self.bursts = {key: np.concatenate(values) if values else np.zeros(0) for key, values in bursts.items()}
 
         log.info("###Distribution analysis ends!")
 
         return occupations, occupations_oc
 
+    def get_bursts(self):
+        """
+        brings burst analysis results (tcrit required)
+        :return: dictionary of arrays: burst length, openings per burst, total open time per burst
+        """
+        return self.bursts
+
     def get_results(self):
         """
         brings numeric results
-        :return: time array, probability array
+        :return: time arrays, state index arrays, cumulative times, cumulative probabilities, occupancy times
         """
         return self.allT, self.allP, self.mcT, self.mcP, self.occupations, self.opsh_occupations
 
-    def get_exp(self, rates, show=False):
+
+def glp_particles(tables, streams, stats=None):
+    """
+    runs particles, one random substream each (process pool worker)
+    :param tables: initial state, starting time, ending time and epoch tables
+    :param streams: list of numpy SeedSequence objects, one per particle
+    :param stats: SolverStats object (telemetry), none collected if not given
+    :return: list of (state index array, time array) tuples
+    """
+    initial, t0, te, edges, cumulative, totals = tables
+    return [glp_trajectory(initial, t0, te, edges, cumulative, totals, np.random.default_rng(stream), stats)
+            for stream in streams]
+
+
+def glp_worker(tables, streams, stats=None):
+    """
+    runs particles in worker process, telemetry is collected locally and sent back for merging
+    :param tables: initial state, starting time, ending time and epoch tables
+    :param streams: list of numpy SeedSequence objects, one per particle
+    :param stats: SolverStats object of this worker, none collected if not given
+    :return: list of (state index array, time array) tuples, SolverStats object
+    """
+    return glp_particles(tables, streams, stats), stats
+
+
+def glp_trajectory(state, t0, te, edges, cumulative, totals, rng, stats=None, block=4096):
+    """
+    single particle Gillespie trajectory, state indexes and jump times are stored in preallocated buffers
+    growing by doubling, random numbers are drawn in blocks; waiting times crossing an epoch boundary are
+    truncated there and redrawn with the new rates (exact for piecewise constant stimuli, dwell times are
+    memoryless), zero rate states simply wait for the next epoch
+    :param state: initial state index
+    :param t0: starting time
+    :param te: ending time
+    :param edges: epoch start times (see SolverGlp.get_epochs)
+    :param cumulative: cumulative jump probabilities (epoch x state x state)
+    :param totals: total exit rates (epoch x state)
+    :param rng: random generator (numpy.random module or Generator)
+    :param stats: SolverStats object (telemetry), none collected if not given
+    :param block: random numbers drawn at once, initial buffer size
+    :return: state index array, time array (state P[i] is occupied from T[i] to T[i + 1], last entry closes
+             trajectory at te)
+    """
+    P = np.empty(block, dtype=int)
+    T = np.empty(block, dtype=float)
+    P[0], T[0] = state, t0
+
+    exponentials, uniforms, draw = rng.standard_exponential(block).tolist(), rng.random(block).tolist(), 0
+    step, t = 0, t0
+    bounds = edges[1:] + [te]
+
+    while t < te:
+        epoch = bisect.bisect_right(edges, t) - 1
+        total = totals[epoch][state]
+
+        if total == 0:
+            t = bounds[epoch]
+            if stats:
+                stats.count('stays')
+            continue
+
+        if draw == block:
+            exponentials, uniforms, draw = rng.standard_exponential(block).tolist(), rng.random(block).tolist(), 0
+        dt = exponentials[draw] / total
+
+        if t + dt >= bounds[epoch]:
+            t = bounds[epoch]
+            draw += 1
+            if stats:
+                stats.count('truncations')
+            continue
+
+        state = bisect.bisect_right(cumulative[epoch][state], uniforms[draw])
+        draw += 1
+        if stats:
+            stats.count('events')
+            stats.trace("#Step: {}, time: {}, state: {}, occupancy time: {}", step, t, P[step], dt)
+
+        step += 1
+        t += dt
+        if step + 1 == len(P):
+            P = np.concatenate((P, np.empty(len(P), dtype=int)))
+            T = np.concatenate((T, np.empty(len(T), dtype=float)))
+        P[step], T[step] = state, t
+
+    step += 1
+    P[step], T[step] = state, te
+
+    return P[:step + 1].copy(), T[:step + 1].copy()
+
+
+class SolverGlpEnsemble:
+
+    def __init__(self, model, P0, n, t0, te, mode='leap', samples=int(1e3), seed=None, stats=None):
         """
-        generates a random number from exponential distribution of lambda equal to sum of give transition rates
-        :param rates: vector (transition rates)
-        :param show: plot exponential pdf with random value
-        :return: scalar (random from exponential distribution)
+        ensemble Monte Carlo solver, all channels are advanced together as arrays
+        :param model: Kinetic object (piecewise constant stimuli only)
+        :param P0: starting conditions (first row taken, normalized to probabilities)
+        :param n: number of channels
+        :param t0: starting time
+        :param te: ending time
+        :param mode: 'leap' (multinomial transitions between samples, exact in distribution at output times, cost
+                     independent of n) or 'exact' (every channel jump simulated, cost grows with number of events,
+                     i.e. n times rates times duration, e.g. 20 s vs 0.015 s for 20000 jwm channels over 1500 ms;
+                     use for small n or when jump times matter)
+        :param samples: number of output time points
+        :param seed: random seed
+        :param stats: SolverStats object (telemetry), none collected if not given
         """
-        all_rates = np.sum(rates)
-        random = np.random.exponential(1.0/all_rates)
-        if show:
-            x = np.linspace(0.0, 0.01 * all_rates, num=100 * all_rates)            # magic: sampling depending on lambda
-            pdf = np.array([all_rates * np.exp(-all_rates * xi) for xi in x])
-            limit = np.where(pdf > 0.00001 * all_rates * np.max(pdf))              # magic: omitting the long tail
-            plt.plot(x[limit], pdf[limit])
-            plt.plot(random, 0.5 * np.max(pdf), '*')
-            plt.show()
-        return random
+        self.model, self.P0, self.n, self.t0, self.te, self.mode, self.samples = model, P0, n, t0, te, mode, samples
+        self.rng = np.random.default_rng(seed)
+        self.stats = stats
+        self.stano = len(P0[0])
+        self.propagators = {}
+
+        log.info("### Initiating ensemble Monte Carlo Solver ({})".format(self.mode))
+        log.info("Channels: {}, States: {}".format(self.n, self.stano))
+        start_time = tm.time()
+        self.counts = self.solve_ensemble()
+        log.info("--- %s seconds ---" % (tm.time() - start_time))
+        if self.stats:
+            self.stats.add_time('ensemble', tm.time() - start_time)
 
-    def get_uni(self, rates):
+    def solve_ensemble(self):
         """
-        chooses a transition on the basis on weighted probability by rate value
-        :param rates: vector (transition rates)
-        :return: scalar (index of random rate from weighted distribution)
+        steps through output times, split at stimulus discontinuities
+        :return: pandas data frame (time + number of channels in each state)
         """
-        idxs = np.arange(self.stano)
-        probs = rates/ne.evaluate('sum(rates)')
-        random = np.random.choice(idxs, p=probs)
-        return random
+        self.model.trm_constant()
+        dt = (self.te - self.t0) / self.samples
+        t = self.t0 + dt * np.arange(1, self.samples + 1)
+        edges = self.model.trm_edges(self.t0, self.te)
+        bounds = np.union1d(t, edges)
+        record = np.isin(bounds, t)
+
+        p0 = np.array(self.P0[0], dtype=float)
+        state = self.rng.choice(self.stano, size=self.n, p=p0 / np.sum(p0))
+        counts = np.zeros((self.samples, self.stano), dtype=int)
+        current = np.bincount(state, minlength=self.stano)
+
+        idx, start = 0, self.t0
+        for end, recorded in zip(bounds, record):
+            levels = self.model.trm_levels(0.5 * (start + end))
+            if self.mode == 'leap':
+                current = self.leap(current, levels, end - start)
+            else:
+                state = self.exact(state, levels, start, end)
+                current = np.bincount(state, minlength=self.stano)
+            if recorded:
+                counts[idx] = current
+                idx += 1
+            start = end
+
+        if self.stats:
+            self.stats.peak('counts', counts.nbytes)
+            self.stats.peak('channels', state.nbytes)
 
+        return pd.DataFrame(data=counts, index=pd.Index(t, name='time'), columns=self.model.states_names)
 
+    def exact(self, state, levels, start, end):
+        """
+        exact jumps of all channels within constant stimulus period, channel clocks are restarted at period
+        start (exponential dwell times are memoryless)
+        :param state: state indexes of all channels
+        :param levels: stimulus values
+        :param start: period start
+        :param end: period end
+        :return: state indexes of all channels at period end
+        """
+        rates = self.model.trm_evaluate(levels, normalize=False)
+        rates[self.model.trm_diag] = 0.
+        total = np.sum(rates, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cumulative = np.cumsum(rates, axis=1) / total[:, np.newaxis]
+        cumulative[:, -1] = 1.                                                  # guard against rounding
+
+        active = np.arange(self.n)
+        clock = np.full(self.n, float(start))
+        while active.size:
+            with np.errstate(divide='ignore'):
+                jump = clock[active] + self.rng.standard_exponential(active.size) / total[state[active]]
+            active = active[jump < end]
+            clock[active] = jump[jump < end]
+            uniforms = self.rng.random(active.size)
+            current = state[active]
+            for origin in np.unique(current):                                  # grouped by current state
+                group = current == origin
+                state[active[group]] = np.searchsorted(cumulative[origin], uniforms[group], side='right')
+            if self.stats:
+                self.stats.count('events', active.size)
+
+        return state
+
+    def leap(self, current, levels, dt):
+        """
+        leaps over period with multinomial transitions of independent channels, exact in distribution at
+        period ends, cost does not depend on channel number
+        :param current: number of channels in each state
+        :param levels: stimulus values
+        :param dt: period length
+        :return: number of channels in each state at period end
+        """
+        key = (levels.tobytes(), round(dt, 12))
+        if key not in self.propagators:
+            propagator = np.clip(lin.expm(self.model.trm_evaluate(levels) * dt), 0., None)
+            self.propagators[key] = propagator / np.sum(propagator, axis=1)[:, np.newaxis]
+        if self.stats:
+            self.stats.count('leaps')
+        return np.sum(self.rng.multinomial(current, self.propagators[key]), axis=0)
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (time + number of channels in each state)
+        """
+        return self.counts
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import scipy.integrate as itg
+import time as tm
+import logging as log
+
+
+class SolverIvp:
+
+    def __init__(self, model, p0, names, t0, te, method='LSODA', samples=int(1e3), rtol=1e-6, atol=1e-9, stats=None):
+        """
+        stiff differential equation solver, restarted at every stimulus discontinuity
+        :param model: Kinetic object
+        :param p0: starting conditions
+        :param names: names of states
+        :param t0: starting time
+        :param te: ending time
+        :param method: solve_ivp method ('Radau', 'BDF' or 'LSODA')
+        :param samples: number of output time points (taken from dense output)
+        :param rtol: relative tolerance
+        :param atol: absolute tolerance
+        :param stats: SolverStats object (telemetry), none collected if not given
+        """
+        self.model, self.p0, self.names, self.t0, self.te = model, p0, names, t0, te
+        self.method, self.samples, self.rtol, self.atol = method, samples, rtol, atol
+        self.stats = stats
+        self.segments = []
+        self.bounds = (t0, te)
+        self.tp = self.solve_ivp()
+
+    def trmn(self, t):
+        """
+        transition rate matrix evaluated strictly inside current segment, the integrator also evaluates
+        at segment end, where stimulus already switched
+        :param t: time
+        :return: normalized transition rate matrix
+        """
+        return self.model.trmn(min(max(t, self.bounds[0]), np.nextafter(self.bounds[1], self.bounds[0])))
+
+    def dpdt(self, t, p):
+        """
+        differential equation: dP/dt = P * A, column form for integrator
+        :param t: time
+        :param p: occupancies
+        :return: derivative
+        """
+        return self.trmn(t).T.dot(p)
+
+    def jacobian(self, t, p):
+        """
+        exact jacobian of dpdt
+        :param t: time
+        :param p: occupancies (unused, system is linear)
+        :return: transposed transition rate matrix (sparse for sparse models, except LSODA taking dense only)
+        """
+        q = self.trmn(t).T
+        if self.model.sparse and self.method == 'LSODA':
+            return q.toarray()
+        return q
+
+    def solve_ivp(self):
+        """
+        integrates segment by segment, output times as in SolverOde
+        :return: pandas data frame (time + states)
+        """
+        bounds = [self.t0] + self.model.trm_edges(self.t0, self.te) + [self.te]
+        p_start = np.array(self.p0, dtype=float)
+
+        log.info("### Initiating {} ODE Solver".format(self.method))
+        start_time = tm.time()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            self.bounds = (start, end)
+            result = itg.solve_ivp(self.dpdt, (start, end), p_start, method=self.method, jac=self.jacobian,
+                                   dense_output=True, rtol=self.rtol, atol=self.atol)
+            if not result.success:
+                raise RuntimeError("Integration failed in segment {} ms to {} ms: {}".format(start, end, result.message))
+            log.info("Segment: {} ms to {} ms Steps: {} Evaluations: {}".format(start, end, len(result.t) - 1, result.nfev))
+            if self.stats:
+                self.stats.count('segments')
+                self.stats.count('steps', len(result.t) - 1)
+                self.stats.count('rhs', result.nfev)
+                self.stats.count('jacobian', int(result.njev))
+                self.stats.count('lu', int(result.nlu))
+                self.stats.peak('trajectory', result.y.nbytes)
+            self.segments.append(result.sol)
+            p_start = result.y[:, -1]
+        if self.stats:
+            self.stats.add_time('integration', tm.time() - start_time)
+        log.info("### Done {} ODE Solver".format(self.method))
+
+        dt = (self.te - self.t0) / self.samples
+        t = self.t0 + dt * np.arange(1, self.samples + 1)
+        tp = pd.DataFrame(data=self.get_dense(t), index=pd.Index(t, name='time'), columns=self.names)
+
+        return tp
+
+    def get_dense(self, t):
+        """
+        evaluates dense output at any times within integration range
+        :param t: array of times
+        :return: array of probabilities (times x states)
+        """
+        bounds = np.array([segment.t_max for segment in self.segments])
+        segment = np.clip(np.searchsorted(bounds, t, side='left'), 0, len(self.segments) - 1)
+
+        p = np.zeros((len(t), len(self.p0)))
+        for idx, solution in enumerate(self.segments):
+            inside = segment == idx
+            if inside.any():
+                p[inside] = solution(t[inside]).T
+        return p
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (time + states)
+        """
+        return self.tp
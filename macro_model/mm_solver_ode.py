@@ -1,12 +1,13 @@
 import numpy as np
 import pandas as pd
 import scipy.integrate as itg
+import time as tm
 import logging as log
 
 
 class SolverOde:
 
-    def __init__(self, a, p0, names, t0, te, steady):
+    def __init__(self, a, p0, names, t0, te, steady, stats=None, samples=int(1e3), atol=1e-4):
         """
         differential equation solver
         :param a: normalized transition rate matrix with stimulus
@@ -15,8 +16,13 @@ class SolverOde:
         :param t0: starting time
         :param te: ending time
         :param steady:
+        :param stats: SolverStats object (telemetry), none collected if not given
+        :param samples: number of output time points
+        :param atol: absolute tolerance of integrator
         """
         self.a, self.p0, self.names, self.t0, self.te, self.steady = a, p0, names, t0, te, steady
+        self.stats = stats
+        self.samples, self.atol = samples, atol
         self.tp = self.solve_kfw()
 
     def solve_kfw(self):
@@ -36,11 +42,13 @@ class SolverOde:
             #if self.steady:
             #    log.info("STEADY")
             #    t = 0
-            return np.dot(p, a(t))
+            if self.stats:
+                self.stats.count('rhs')
+            return a(t).T.dot(p)
 
-        rk45 = itg.ode(dpdt).set_integrator('lsoda', nsteps=1e4, atol=0.0001)
+        rk45 = itg.ode(dpdt).set_integrator('lsoda', nsteps=1e4, atol=self.atol)
         rk45.set_initial_value(self.p0, self.t0).set_f_params(self.a)
-        samples = int(1e3)
+        samples = self.samples
         dt = self.te / samples
 
         p = np.zeros((samples + 1, len(self.p0)))
@@ -50,13 +58,18 @@ class SolverOde:
 
         idx = 0
         log.info("### Initiating RK ODE Solver")
+        start_time = tm.time()
         while rk45.successful() and rk45.t < self.te:
             rk45.integrate(rk45.t+dt)
-            result = np.array(rk45.y)
-            log.info("Step: {} Occupancies: {}".format(idx, result))
-            p[idx, :] = result
+            p[idx, :] = rk45.y
             t[idx] = rk45.t
+            if self.stats:
+                self.stats.count('steps')
+                self.stats.trace("Step: {} Occupancies: {}", idx, p[idx])
             idx += 1
+        if self.stats:
+            self.stats.add_time('integration', tm.time() - start_time)
+            self.stats.peak('occupancies', p.nbytes)
         log.info("### Done RK ODE Solver")
 
         p = p[0:-1]
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+import scipy.sparse.linalg as spl
+import logging as log
+
+
+class SolverSteady:
+
+    def __init__(self, models, p0, names, concentrations):
+        """
+        equilibrium solver, every stimulus is held constant at its applied level (see Kinetic.trm_plateau), so
+        steady states come from the same transition rate matrix as the transient during stimulation
+        :param models: list of Kinetic objects sharing states
+        :param p0: starting conditions (only total occupancy is used)
+        :param names: names of states
+        :param concentrations: list of agonist concentrations, one per model (result labels)
+        """
+        self.models, self.p0, self.names, self.concentrations = models, p0, names, concentrations
+        self.p = self.solve_steady()
+
+    def trm_stack(self):
+        """
+        stacks transition rate matrices with stimuli held at applied levels
+        :return: array (concentrations x states x states)
+        """
+        return np.array([model.trm_evaluate(model.trm_plateau()) for model in self.models])
+
+    def solve_steady(self):
+        """
+        solves p * Q = 0 with sum(p) = 1 for all concentrations at once, directly as Q^T * p = 0 with last
+        (redundant) equation replaced by normalization
+        :return: pandas data frame (concentration + states)
+        """
+        log.info("### Initiating steady state solver")
+        if any(model.sparse for model in self.models):
+            p = np.array([self.solve_sparse(model) for model in self.models]) * np.sum(self.p0)
+            log.info("### Done steady state solver")
+            return pd.DataFrame(data=p, index=pd.Index(self.concentrations, name='concentration'), columns=self.names)
+
+        a = self.trm_stack().transpose(0, 2, 1).copy()
+        a[:, -1, :] = 1.
+        b = np.zeros(a.shape[:2])
+        b[:, -1] = 1.
+        p = np.linalg.solve(a, b[:, :, np.newaxis])[:, :, 0]
+        p = p * np.sum(self.p0)
+        log.info("### Done steady state solver")
+
+        return pd.DataFrame(data=p, index=pd.Index(self.concentrations, name='concentration'), columns=self.names)
+
+    @staticmethod
+    def solve_sparse(model):
+        """
+        sparse steady state: Q^T * p = 0 with last equation replaced by sum(p) = 1
+        :param model: Kinetic object (sparse)
+        :return: vector of probabilities
+        """
+        q = sps.csr_matrix(model.trm_evaluate(model.trm_plateau()))
+        n = q.shape[0]
+        a = sps.vstack((q.T.tocsr()[:-1], sps.csr_matrix(np.ones((1, n))))).tocsc()
+        b = np.zeros(n)
+        b[-1] = 1.
+        return spl.spsolve(a, b)
+
+    def get_results(self):
+        """
+        brings numeric results
+        :return: pandas data frame (concentration + states)
+        """
+        return self.p
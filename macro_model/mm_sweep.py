@@ -0,0 +1,223 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import scipy.stats.qmc as qmc
+import concurrent.futures as cf
+import time as tm
+import logging as log
+from mm_kinetic_models import ModelBuilder
+from mm_solver_batch import SolverBatch
+
+
+class Sweep:
+
+    def __init__(self, model, ranges, concentrations, t0, te, path, design='grid', points=10, seed=None,
+                 stimulus='single', open_category='open', chunk=20, workers=1, samples=int(1e3)):
+        """
+        parameter sweep over registered mechanism rates, rate sets are propagated chunk by chunk (all concentrations
+        of a chunk in one batch solve), metrics of every chunk are stored in a separate npz file, finished chunks are
+        skipped when sweep is restarted in the same directory
+        :param model: registered mechanism name (see mm_kinetic_models.MODELS)
+        :param ranges: dictionary (rate name: (low, high)), sampled in log10 space, multiples of swept rate
+                       ('2kon' for 'kon') follow it
+        :param concentrations: list of agonist concentrations (increasing, for EC50)
+        :param t0: starting time
+        :param te: ending time
+        :param path: sweep directory (design and chunk files), restart requires the same sweep specification
+        :param design: 'grid' (points per rate), 'lhs' (Latin hypercube, points in total) or 'sobol' (points in total)
+        :param points: number of points
+        :param seed: random seed of 'lhs' and 'sobol' designs
+        :param stimulus: stimulus type ('single' or 'pair', see ModelBuilder)
+        :param open_category: category of open states (see ModelBuilder.states_belongs)
+        :param chunk: number of rate sets per chunk
+        :param workers: number of worker processes
+        :param samples: number of output time points
+        """
+        self.model, self.ranges, self.concentrations, self.t0, self.te = model, ranges, list(concentrations), t0, te
+        self.path, self.design, self.points, self.seed = path, design, points, seed
+        self.stimulus, self.open_category, self.chunk, self.workers, self.samples = stimulus, open_category, chunk, workers, samples
+        self.names = list(ranges)
+
+        categories = ModelBuilder(self.model, self.concentrations[:1], self.stimulus).states_belongs
+        if self.open_category not in categories:
+            raise ValueError("Unknown open category {!r} of {}, categories: {}".format(self.open_category, self.model, list(categories)))
+
+        os.makedirs(self.path, exist_ok=True)
+        self.rates = self.get_design()
+        self.solve_sweep()
+        self.results = self.get_results()
+
+    def get_spec(self):
+        """
+        :return: sweep specification (everything the design and chunk files depend on), JSON compatible
+        """
+        return json.loads(json.dumps({
+            'model': self.model, 'names': self.names,
+            'ranges': [[float(self.ranges[name][0]), float(self.ranges[name][1])] for name in self.names],
+            'design': self.design, 'points': self.points, 'seed': self.seed,
+            'concentrations': [float(concentration) for concentration in self.concentrations],
+            'stimulus': self.stimulus, 'open_category': self.open_category, 't0': float(self.t0), 'te': float(self.te),
+            'samples': int(self.samples), 'chunk': int(self.chunk)}))
+
+    def get_design(self):
+        """
+        creates rate sets, design is stored with sweep specification at first run and reused on restart
+        :return: array (rate sets x swept rates)
+        """
+        filename = os.path.join(self.path, 'design.npz')
+        spec = self.get_spec()
+        if os.path.exists(filename):
+            with np.load(filename, allow_pickle=False) as stored:
+                previous = json.loads(str(stored['spec'])) if 'spec' in stored.files else {}
+                changed = [key for key in spec if key not in previous or previous[key] != spec[key]]
+                if changed:
+                    raise ValueError("Sweep directory {} holds other sweep, differing in: {}".format(self.path, changed))
+                log.info("Design loaded: {}".format(filename))
+                return stored['rates']
+
+        low = np.log10([self.ranges[name][0] for name in self.names])
+        high = np.log10([self.ranges[name][1] for name in self.names])
+        if self.design == 'grid':
+            unit = np.array(np.meshgrid(*[np.linspace(0., 1., self.points)] * len(self.names), indexing='ij')).reshape(len(self.names), -1).T
+        elif self.design == 'lhs':
+            unit = qmc.LatinHypercube(d=len(self.names), seed=self.seed).random(self.points)
+        elif self.design == 'sobol':
+            unit = qmc.Sobol(d=len(self.names), seed=self.seed).random(self.points)
+        else:
+            raise ValueError("Unknown design: {}".format(self.design))
+        rates = 10 ** qmc.scale(unit, low, high) if len(self.names) else unit
+
+        np.savez(filename, names=np.array(self.names), rates=rates, spec=np.array(json.dumps(spec)))
+        return rates
+
+    def solve_sweep(self):
+        """
+        runs unfinished chunks, in worker processes if more than one worker
+        """
+        chunks = [idx for idx in range(0, len(self.rates), self.chunk) if not os.path.exists(self.chunk_file(idx))]
+        log.info("### Initiating parameter sweep")
+        log.info("Rate sets: {} Chunks: {} Remaining: {}".format(len(self.rates), -(-len(self.rates) // self.chunk), len(chunks)))
+        start_time = tm.time()
+
+        arguments = [(self.model, self.concentrations, self.stimulus, self.open_category, self.t0, self.te, self.samples,
+                      self.names, self.rates[idx:idx + self.chunk], idx, self.chunk_file(idx)) for idx in chunks]
+        if self.workers > 1:
+            with cf.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for filename in pool.map(sweep_chunk, *zip(*arguments)):
+                    log.info("Chunk done: {}".format(filename))
+        else:
+            for argument in arguments:
+                log.info("Chunk done: {}".format(sweep_chunk(*argument)))
+
+        log.info("--- %s seconds ---" % (tm.time() - start_time))
+        log.info("### Done parameter sweep")
+
+    def chunk_file(self, idx):
+        """
+        :param idx: index of first rate set of chunk
+        :return: chunk file name
+        """
+        return os.path.join(self.path, 'chunk_{:08d}.npz'.format(idx))
+
+    def get_results(self):
+        """
+        collects stored chunks
+        :return: pandas data frame (rate set, swept rates, concentration + metrics)
+        """
+        columns = {}
+        for idx in range(0, len(self.rates), self.chunk):
+            with np.load(self.chunk_file(idx), allow_pickle=False) as stored:
+                for name in stored.files:
+                    columns.setdefault(name, []).append(stored[name])
+        return pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
+
+
+def sweep_metrics(t, po, end):
+    """
+    response metrics of open probability trajectories
+    :param t: array of times
+    :param po: open probabilities (times x systems)
+    :param end: end of stimulus, desensitization is measured there
+    :return: peak open probability, 10-90% rise time, desensitization (relative loss of peak at stimulus end)
+    """
+    peak = np.max(po, axis=0)
+    rise = sweep_crossing(t, po, 0.9 * peak) - sweep_crossing(t, po, 0.1 * peak)
+    last = max(np.searchsorted(t, end, side='right') - 1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desensitization = np.where(peak > 0, 1. - po[last] / peak, 0.)
+    rise[peak <= 0] = np.nan
+    return peak, rise, desensitization
+
+
+def sweep_crossing(t, po, level):
+    """
+    first upward crossing of level, interpolated linearly between bracketing samples
+    :param t: array of times
+    :param po: open probabilities (times x systems)
+    :param level: vector of levels (one per system)
+    :return: vector of crossing times
+    """
+    columns = np.arange(po.shape[1])
+    after = np.argmax(po >= level, axis=0)
+    before = np.maximum(after - 1, 0)
+    low, high = po[before, columns], po[after, columns]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(high > low, (level - low) / (high - low), 1.)
+    return t[before] + np.clip(fraction, 0., 1.) * (t[after] - t[before])
+
+
+def sweep_ec50(concentrations, peak):
+    """
+    concentration of half-maximal peak response, interpolated in log10 concentration
+    :param concentrations: increasing concentrations
+    :param peak: peak open probabilities (concentrations x rate sets)
+    :return: vector of EC50 values (nan if half-maximum is not crossed)
+    """
+    ec50 = np.full(peak.shape[1], np.nan)
+    logc = np.log10(concentrations)
+    for idx in range(peak.shape[1]):
+        response = peak[:, idx]
+        half = 0.5 * np.max(response)
+        crossed = np.nonzero((response[:-1] < half) & (response[1:] >= half))[0]
+        if len(crossed):
+            k = crossed[0]
+            ec50[idx] = 10 ** np.interp(half, response[k:k + 2], logc[k:k + 2])
+    return ec50
+
+
+def sweep_chunk(model, concentrations, stimulus, open_category, t0, te, samples, names, rates, first, filename):
+    """
+    solves and stores one chunk of rate sets (process pool worker)
+    :param first: index of first rate set of chunk
+    :param filename: chunk file, written atomically
+    :return: chunk file name
+    """
+    models = ModelBuilder(model, concentrations, stimulus)
+    multiples = [models.models[0].trm_multiples(name) for name in names]
+    overrides = [{multiple: factor * value for tied, value in zip(multiples, values) for multiple, factor in tied.items()}
+                 for values in rates]
+
+    batch = SolverBatch(models.models, models.states_ini_concentrations, models.states_names, t0, te,
+                        labels=concentrations, rates=overrides, samples=samples)
+    tp = batch.get_results()
+    opened = tp.columns.get_level_values('state').isin(models.states_belongs[open_category])
+    po = tp.loc[:, opened].T.groupby(level=['model', 'rates'], sort=False).sum().T.values
+    initial = np.sum(np.array(models.states_ini_concentrations)[np.isin(models.states_names, models.states_belongs[open_category])])
+    t, po = np.concatenate(([t0], tp.index.values)), np.vstack((np.full(po.shape[1], initial), po))  # rise from t0
+
+    edges = [edge for stimulus in models.models[0].trm_stimuli for edge in stimulus.edges if np.isfinite(edge)]
+    peak, rise, desensitization = sweep_metrics(t, po, min(max(edges), te) if edges else te)
+    shape = (len(concentrations), len(rates))
+    ec50 = sweep_ec50(concentrations, peak.reshape(shape))
+
+    columns = {'set': np.tile(first + np.arange(len(rates)), len(concentrations)),
+               'concentration': np.repeat(np.array(concentrations, dtype=float), len(rates)),
+               'peak': peak, 'rise': rise, 'desensitization': desensitization, 'ec50': np.tile(ec50, len(concentrations))}
+    for idx, name in enumerate(names):
+        columns[name] = np.tile(rates[:, idx], len(concentrations))
+
+    temporary = filename + '.tmp.npz'
+    np.savez(temporary, **columns)
+    os.replace(temporary, filename)
+    return filename
@@ -0,0 +1,98 @@
+import time as tm
+import collections
+import contextlib
+import logging as log
+
+
+class SolverStats:
+    """
+    solver telemetry: counters, wall time per stage, peak array sizes and sampled trace, solvers take
+    stats=None by default and skip all bookkeeping then
+    """
+    def __init__(self, trace=0):
+        """
+        :param trace: log every n-th trace record at DEBUG level (0 - no trace output)
+        """
+        self.trace_every = trace
+        self.counters = collections.Counter()
+        self.timers = collections.OrderedDict()
+        self.peaks = {}
+        self.traced = 0
+
+    def count(self, name, n=1):
+        """
+        :param name: counter name (e.g. 'rhs', 'steps', 'events')
+        :param n: increment
+        """
+        self.counters[name] += n
+
+    def peak(self, name, nbytes):
+        """
+        keeps maximum of reported array size
+        :param name: array name
+        :param nbytes: array size in bytes
+        """
+        if nbytes > self.peaks.get(name, 0):
+            self.peaks[name] = nbytes
+
+    def add_time(self, name, seconds):
+        """
+        accumulates wall time of a stage
+        :param name: stage name
+        :param seconds: elapsed time
+        """
+        self.timers[name] = self.timers.get(name, 0.) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        accumulates wall time of a stage (context manager)
+        :param name: stage name
+        """
+        start_time = tm.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, tm.time() - start_time)
+
+    def merge(self, other):
+        """
+        adds telemetry collected elsewhere (e.g. in worker process): counters and stage times are summed,
+        peaks take maximum
+        :param other: SolverStats object
+        """
+        self.counters.update(other.counters)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+        for name, nbytes in other.peaks.items():
+            self.peak(name, nbytes)
+        self.traced += other.traced
+
+    def trace(self, message, *args):
+        """
+        sampled trace, message is formatted only for logged records
+        :param message: format string
+        :param args: format arguments
+        """
+        if self.trace_every:
+            if self.traced % self.trace_every == 0:
+                log.debug(message.format(*args))
+            self.traced += 1
+
+    def as_dict(self):
+        """
+        :return: dictionary of counters, stage times [s] and peak array sizes [bytes]
+        """
+        return {'counters': dict(self.counters), 'timers': dict(self.timers), 'peaks': dict(self.peaks)}
+
+    def report(self):
+        """
+        logs collected telemetry
+        """
+        log.info("### Solver telemetry")
+        for name, value in self.counters.items():
+            log.info("Counter: {} = {}".format(name, value))
+        for name, value in self.timers.items():
+            log.info("Stage: {} = {:.6f} s".format(name, value))
+        for name, value in self.peaks.items():
+            log.info("Peak array: {} = {} bytes".format(name, value))
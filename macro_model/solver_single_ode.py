@@ -1,12 +1,13 @@
 import numpy as np
 import pandas as pd
 import scipy.integrate as itg
+import time as tm
 import logging as log
 
 
 class SolverOde:
 
-    def __init__(self, a, p0, names, t0, te):
+    def __init__(self, a, p0, names, t0, te, stats=None, samples=int(1e4), atol=1e-3):
         """
         differential equation solver
         :param a: normalized transition rate matrix with stimulus
@@ -14,8 +15,13 @@ class SolverOde:
         :param names: names of states
         :param t0: starting time
         :param te: ending time
+        :param stats: SolverStats object (telemetry), none collected if not given
+        :param samples: number of output time points
+        :param atol: absolute tolerance of integrator
         """
         self.a, self.p0, self.names, self.t0, self.te = a, p0, names, t0, te
+        self.stats = stats
+        self.samples, self.atol = samples, atol
         self.tp = self.solve_kfw()
 
     def solve_kfw(self):
@@ -32,11 +38,13 @@ class SolverOde:
             :param a: transition rate matrix row normalized
             :return: differential equation for integrator
             """
+            if self.stats:
+                self.stats.count('rhs')
             return np.dot(p, a(t))
 
-        rk45 = itg.ode(dpdt).set_integrator('dopri5', nsteps=1e3, atol=0.001)
+        rk45 = itg.ode(dpdt).set_integrator('dopri5', nsteps=1e3, atol=self.atol)
         rk45.set_initial_value(self.p0, self.t0).set_f_params(self.a)
-        samples = int(1e4)
+        samples = self.samples
         dt = self.te / samples
 
         p = np.zeros((samples + 1, len(self.p0)))
@@ -46,13 +54,18 @@ class SolverOde:
 
         idx = 0
         log.info("### Initiating RK ODE Solver")
+        start_time = tm.time()
         while rk45.successful() and rk45.t < self.te:
             rk45.integrate(rk45.t+dt)
-            result = np.array(rk45.y)
-            log.info("Step: {} Occupancies: {}".format(idx, result))
-            p[idx, :] = result
+            p[idx, :] = rk45.y
             t[idx] = rk45.t
+            if self.stats:
+                self.stats.count('steps')
+                self.stats.trace("Step: {} Occupancies: {}", idx, p[idx])
             idx += 1
+        if self.stats:
+            self.stats.add_time('integration', tm.time() - start_time)
+            self.stats.peak('occupancies', p.nbytes)
         log.info("### Done RK ODE Solver")
 
         p = p[0:-1]
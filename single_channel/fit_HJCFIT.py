@@ -8,11 +8,12 @@ import re
 from scipy.optimize import minimize
 
 from dcpyps.samples import samples
-from dcpyps import dataset
 from dcpyps import mechanism
 
 from dcprogs.likelihood import Log10Likelihood
 
+from mm_scn_cache import scn_record
+
 
 def dcprogslik(x):
     mec.theta_unsqueeze(np.exp(x))
@@ -88,8 +89,7 @@ if args.config:
         sc_scns = list(single_cell.loc[:, 'file_scn'])
         sc_scns = [name if name.endswith('.SCN') else name + '.SCN' for name in sc_scns]
         sc_scns = [full_name.upper() for full_name in sc_scns]
-        rec = dataset.SCRecord(sc_scns, 100e-9, sc_tres, sc_tcrit)
-        rec.record_type = 'recorded'
+        rec = scn_record(sc_scns, 100e-9, sc_tres, sc_tcrit)
         rec.printout()
 
         if sc_model == 'CO':
@@ -157,8 +157,7 @@ else:
 
     ### running without config file, rather legacy for testing only, probably refecator/update needed
 
-    rec = dataset.SCRecord(args.files, 100e-9, args.tres, args.tcrit)
-    rec.record_type = 'recorded'
+    rec = scn_record(args.files, 100e-9, args.tres, args.tcrit)
     rec.printout()
 
     mec = mechanism_RO([5000, 5000])
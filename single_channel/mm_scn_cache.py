@@ -0,0 +1 @@
+../macro_model/mm_scn_cache.py
\ No newline at end of file